@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+# Micro benchmarks for the render and display pipeline.
+# Run them on the target board, e.g.:
+#   python3 benchmark.py getbuffer --repeat 5
+# or on any machine with the simulated panel (model = virtual):
+#   python3 benchmark.py pipeline --config virtual.ini
+
+
+def _timeit(func, repeat: int) -> float:
+    """
+    Runs func 'repeat' times and returns the best wall time in milliseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _random_panel_image(width: int, height: int, palette: tuple, seed: int = 0) -> Image:
+    """
+    Builds an RGB test frame made of panel colours plus a few off-palette pixels.
+    """
+    rng = np.random.default_rng(seed)
+    colors = np.array(palette + ((0x12, 0x34, 0x56),), dtype=np.uint8)
+    codes = rng.integers(0, len(colors), size=(height, width))
+    return Image.fromarray(colors[codes], 'RGB')
+
+
+def _palette_image(palette: tuple) -> Image:
+    """
+    Returns a 'P' image carrying the given palette, padded with black.
+    """
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([c for rgb in palette for c in rgb] + [0, 0, 0] * (256 - len(palette)))
+    return palette_image
+
+
+def bench_getbuffer(args):
+    """
+    Compares the numpy frame packer against the legacy per-pixel loop.
+    """
+    from lib import epd4in01f
+    epd = epd4in01f.EPD()
+    for name, size in (('landscape', (epd.width, epd.height)), ('portrait', (epd.height, epd.width))):
+        image = _random_panel_image(size[0], size[1], epd4in01f.PALETTE_RGB)
+        if bytes(epd.getbuffer(image)) != bytes(epd.getbuffer_legacy(image)):
+            print(f'getbuffer {name}: output differs from the legacy implementation')
+            return 1
+        legacy_ms = _timeit(lambda: epd.getbuffer_legacy(image), args.repeat)
+        numpy_ms = _timeit(lambda: epd.getbuffer(image), args.repeat)
+        print(f'getbuffer {name}: legacy {legacy_ms:.1f} ms, numpy {numpy_ms:.1f} ms, '
+              f'speedup x{legacy_ms / numpy_ms:.1f}')
+
+    # 'P' frames as produced by _convert_image_wave skip the RGB round trip
+    image = _random_panel_image(epd.width, epd.height, epd4in01f.PALETTE_RGB)
+    image = image.quantize(palette=_palette_image(epd4in01f.PALETTE_RGB), dither=Image.Dither.NONE)
+    indices = image.tobytes()
+    if bytes(epd.getbuffer_indices(indices, *image.size)) != bytes(epd.getbuffer(image)):
+        print('getbuffer palette: output differs from the RGB path')
+        return 1
+    rgb_ms = _timeit(lambda: epd.getbuffer(image), args.repeat)
+    indices_ms = _timeit(lambda: epd.getbuffer_indices(image.tobytes(), *image.size), args.repeat)
+    print(f'getbuffer palette: via RGB {rgb_ms:.1f} ms, indices {indices_ms:.1f} ms')
+    return 0
+
+
+def bench_linebreak(args):
+    """
+    Compares the cached word width line breaker against the recursive one
+    on long multi-artist strings, counting the FreeType measurements.
+    """
+    import textLayout
+    from PIL import ImageDraw, ImageFont
+    font_path = os.path.join(os.path.dirname(__file__), '..', 'resources', 'CircularStd-Bold.otf')
+    draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    artists = ['Beyoncé', 'JAY-Z', 'Kendrick Lamar', 'Tove Lo', 'Sigur Rós', 'Tiësto', 'Florence + The Machine',
+               'A Tribe Called Quest', 'Yeah Yeah Yeahs', 'Wolfgang Amadeus Mozart', 'AVAION', 'Kygo']
+    rng = np.random.default_rng(0)
+    texts = [', '.join(rng.choice(artists, size=rng.integers(3, 12))) for _ in range(50)]
+    for size in (35, 45):
+        font = ImageFont.truetype(font_path, size)
+        width = 600
+        legacy = [list(textLayout.break_lines_legacy(t, width, font, draw)) for t in texts]
+        cached = [list(textLayout.break_lines(t, width, font)) for t in texts]
+        if legacy != cached:
+            print(f'linebreak {size}px: output differs from the legacy implementation')
+            return 1
+        calls = [0]
+        getlength = font.getlength
+
+        def counting_getlength(*a, **kw):
+            calls[0] += 1
+            return getlength(*a, **kw)
+        font.getlength = counting_getlength
+        for t in texts:
+            list(textLayout.break_lines_legacy(t, width, font, draw))
+        legacy_calls, calls[0] = calls[0], 0
+        # Start from an empty word cache to count the first run's measurements
+        textLayout._word_widths.pop(font, None)
+        for t in texts:
+            list(textLayout.break_lines(t, width, font))
+        cached_calls = calls[0]
+        del font.getlength
+        legacy_ms = _timeit(lambda: [list(textLayout.break_lines_legacy(t, width, font, draw)) for t in texts], args.repeat)
+        cached_ms = _timeit(lambda: [list(textLayout.break_lines(t, width, font)) for t in texts], args.repeat)
+        print(f'linebreak {size}px, {len(texts)} strings: legacy {legacy_ms:.2f} ms / {legacy_calls} measurements, '
+              f'cached {cached_ms:.2f} ms / {cached_calls} measurements on a cold cache')
+    return 0
+
+
+def bench_dither(args):
+    """
+    Times each dithering engine on a rendered frame at the Waveshare 4" and
+    Inky Impression 5.7" sizes.
+    """
+    import colorQuantizer
+    palette = colorQuantizer.WAVESHARE_PALETTE
+    cover = Image.open(os.path.join(os.path.dirname(__file__), '..', 'resources', 'default.jpg')).convert('RGB')
+    lut = colorQuantizer.build_lut(palette, 2.0)
+    threads = os.cpu_count() or 1
+    engines = [
+        ('floyd-steinberg', lambda img: colorQuantizer.quantize_dithered(img, palette, 2.0)),
+        ('ordered', lambda img: colorQuantizer.quantize_ordered(img, lut, palette)),
+        ('none', lambda img: colorQuantizer.quantize_lut(img, lut, palette)),
+    ]
+    if threads > 1:
+        engines.insert(2, (f'ordered {threads} threads',
+                           lambda img: colorQuantizer.quantize_ordered(img, lut, palette, threads=threads)))
+    for size in ((640, 400), (600, 448)):
+        frame = cover.resize(size)
+        results = ', '.join(f'{name} {_timeit(lambda: quantize(frame), args.repeat):.1f} ms'
+                            for name, quantize in engines)
+        print(f'dither {size[0]}x{size[1]}: {results}')
+    return 0
+
+
+def bench_pipeline(args):
+    """
+    Renders frames and shows them through the display worker. Meant for a
+    config with model = virtual, so it runs without panel hardware.
+    """
+    from spotipiEinkDisplay import SpotipiEinkDisplay
+    service = SpotipiEinkDisplay(config_file=args.config)
+    # Play through one album, its cover comes from disk instead of the network
+    service._load_cover = lambda url: service._open_image(service.default_idle_image)
+    service.display_worker.start()
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        # A different title per run, identical frames would be skipped
+        frame = service._gen_track_pic('benchmark-album', artist='Benchmark Artist', title=f'Benchmark Frame {i}')
+        rendered = time.perf_counter()
+        service.display_worker.submit(frame)
+        service.display_worker.wait_idle()
+        shown = time.perf_counter()
+        parts = ', '.join(f'{part} {ms:.1f}' for part, ms in service.render_timings.items())
+        print(f'pipeline frame {i}: render {(rendered - start) * 1000.0:.1f} ms ({parts}), '
+              f'display {(shown - rendered) * 1000.0:.1f} ms')
+    print(f'font cache: {service.font_cache.stats()}')
+    print(f'layer caches: {service.layer_cache_stats()}')
+    if service.settings.model == 'virtual':
+        print(f'virtual panel: {service.wave4.epdconfig.implementation.stats}')
+    service._close_panel()
+    return 0
+
+
+BENCHMARKS = {
+    'dither': bench_dither,
+    'getbuffer': bench_getbuffer,
+    'linebreak': bench_linebreak,
+    'pipeline': bench_pipeline,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spotipi eInk benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), nargs='+')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, best one is reported')
+    parser.add_argument('--config', help='eink_options.ini to use for the pipeline benchmark')
+    args = parser.parse_args()
+    result = 0
+    for name in args.benchmark:
+        result |= BENCHMARKS[name](args) or 0
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import os
+import hashlib
+import logging
+import functools
+import concurrent.futures
+import numpy as np
+from PIL import Image, ImageEnhance
+
+logger = logging.getLogger(__name__)
+
+# Waveshare 4" 7-colour palette, the index is the panel colour code
+WAVESHARE_PALETTE = (
+    (0x00, 0x00, 0x00),  # black
+    (0xff, 0xff, 0xff),  # white
+    (0x00, 0xff, 0x00),  # green
+    (0x00, 0x00, 0xff),  # blue
+    (0xff, 0x00, 0x00),  # red
+    (0xff, 0xff, 0x00),  # yellow
+    (0xff, 0x80, 0x00),  # orange
+)
+
+# Bits kept per channel by the lookup table, 6 gives 64x64x64 entries (256 KiB)
+LUT_BITS = 6
+
+# 8x8 Bayer threshold matrix, values 0..63
+BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.int16)
+
+# Brightness range the ordered dither spreads a colour over, in 8 bit steps.
+# The panel colours are far apart, a smaller spread leaves visible banding
+ORDERED_SPREAD = 96
+
+# Rows per strip when ordered dithering runs on several cores, a multiple of 8
+STRIP_ROWS = 64
+
+# Thread pools for strip dithering by thread count, created on first use
+_executors = {}
+
+
+@functools.lru_cache(maxsize=4)
+def palette_image(palette: tuple) -> Image:
+    """
+    Returns a 'P' image carrying 'palette' padded with black, built once per palette.
+    """
+    image = Image.new('P', (1, 1))
+    image.putpalette([c for rgb in palette for c in rgb] + [0, 0, 0] * (256 - len(palette)))
+    image.load()
+    return image
+
+
+def quantize_dithered(img: Image, palette: tuple, saturation: float) -> Image:
+    """
+    Boosts the colour saturation and maps 'img' onto 'palette' with
+    Floyd-Steinberg error diffusion.
+    """
+    img = ImageEnhance.Color(img).enhance(saturation)
+    img.load()
+    return img._new(img.im.convert('P', True, palette_image(palette).im))
+
+
+def build_lut(palette: tuple, saturation: float, bits: int = LUT_BITS) -> np.ndarray:
+    """
+    Returns a flat uint8 table mapping a colour, cut to 'bits' per channel and
+    packed as (r << 2 * bits) | (g << bits) | b, to the index of the nearest
+    palette colour after the same saturation boost ImageEnhance.Color applies.
+    """
+    levels = 1 << bits
+    step = 256 // levels
+    # Centre of each cell, e.g. 2, 6, 10, ... for 6 bits
+    values = np.arange(levels, dtype=np.float32) * step + (step - 1) / 2.0
+    r, g, b = np.meshgrid(values, values, values, indexing='ij')
+    rgb = np.stack((r, g, b), axis=-1).reshape(-1, 3)
+    # ImageEnhance.Color blends with the 'L' conversion of the image
+    gray = (rgb @ np.array([299, 587, 114], dtype=np.float32) / 1000.0)[:, None]
+    rgb = np.clip(gray + saturation * (rgb - gray), 0, 255)
+    colors = np.array(palette, dtype=np.float32)
+    distance = ((rgb[:, None, :] - colors[None, :, :]) ** 2).sum(axis=-1)
+    return distance.argmin(axis=1).astype(np.uint8)
+
+
+def lut_path(cache_dir: str, palette: tuple, saturation: float, bits: int = LUT_BITS) -> str:
+    """
+    Cache file of the table for this palette and saturation, a change of
+    either one points to a different file.
+    """
+    key = hashlib.blake2b(repr((palette, float(saturation), bits)).encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f'palette_lut_{key}.npy')
+
+
+def load_lut(cache_dir: str, palette: tuple, saturation: float, bits: int = LUT_BITS) -> np.ndarray:
+    """
+    Memory maps the cached table, building and saving it first if needed.
+    Without a usable cache directory the table is built in memory.
+    """
+    path = lut_path(cache_dir, palette, saturation, bits)
+    try:
+        return np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f'Discarding unreadable palette lookup table {path}: {e}')
+    lut = build_lut(palette, saturation, bits)
+    tmp_path = path + '.tmp'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.save(f, lut)
+        os.replace(tmp_path, path)
+        logger.info(f'Saved palette lookup table {path}')
+        return np.load(path, mmap_mode='r')
+    except OSError as e:
+        logger.warning(f'Failed to save palette lookup table {path}: {e}')
+        return lut
+
+
+def quantize_lut(img: Image, lut: np.ndarray, palette: tuple, bits: int = LUT_BITS) -> Image:
+    """
+    Maps every pixel of 'img' to its palette index with a single table lookup,
+    without dithering.
+    """
+    rgb = np.asarray(img.convert('RGB'))
+    result = Image.fromarray(np.take(lut, _lut_index(rgb, bits)), 'P')
+    result.putpalette(palette_image(palette).getpalette())
+    return result
+
+
+def _lut_index(rgb: np.ndarray, bits: int) -> np.ndarray:
+    shift = 8 - bits
+    index = (rgb[..., 0] >> shift).astype(np.uint32) << (2 * bits)
+    index |= (rgb[..., 1] >> shift).astype(np.uint32) << bits
+    index |= rgb[..., 2] >> shift
+    return index
+
+
+@functools.lru_cache(maxsize=4)
+def _channel_tables(bits: int) -> tuple:
+    """
+    Per channel tables turning a value plus a dither offset, shifted by
+    ORDERED_SPREAD // 2 + 1 to stay positive, into its clipped share of the lookup index.
+    """
+    pad = ORDERED_SPREAD // 2 + 1
+    values = (np.clip(np.arange(-pad, 256 + pad), 0, 255) >> (8 - bits)).astype(np.uint32)
+    return values << (2 * bits), values << bits, values
+
+
+@functools.lru_cache(maxsize=16)
+def _bayer_offsets(height: int, width: int, phase: int) -> np.ndarray:
+    """
+    Dither offsets for a 'height' x 'width' strip starting 'phase' rows into the
+    8x8 pattern, including the positive shift the channel tables expect.
+    """
+    rows = (np.arange(phase, phase + height) % 8)[:, None]
+    cols = (np.arange(width) % 8)[None, :]
+    offsets = ((BAYER_8[rows, cols] * 2 + 1 - 64) * ORDERED_SPREAD) // 128
+    return (offsets + ORDERED_SPREAD // 2 + 1).astype(np.int16)
+
+
+def _dither_strip(rgb: np.ndarray, out: np.ndarray, lut: np.ndarray, y0: int, bits: int):
+    """
+    Ordered dithers the rows of 'rgb' into 'out'. 'y0' is the strip's first row
+    in the frame, the threshold pattern follows frame coordinates so strips line up.
+    """
+    # Same offset on all channels: it shifts the brightness and leaves the
+    # colour alone, so it commutes with the saturation baked into the table
+    offsets = _bayer_offsets(rgb.shape[0], rgb.shape[1], y0 % 8)
+    red, green, blue = _channel_tables(bits)
+    index = red[rgb[..., 0] + offsets]
+    index |= green[rgb[..., 1] + offsets]
+    index |= blue[rgb[..., 2] + offsets]
+    np.take(lut, index, out=out)
+
+
+def quantize_ordered(img: Image, lut: np.ndarray, palette: tuple, threads: int = 1, bits: int = LUT_BITS) -> Image:
+    """
+    Maps 'img' onto the palette of 'lut' with 8x8 Bayer ordered dithering.
+    Every pixel is independent, with 'threads' > 1 the frame is processed as
+    horizontal strips on a thread pool (numpy releases the GIL meanwhile).
+    """
+    rgb = np.asarray(img.convert('RGB'))
+    out = np.empty(rgb.shape[:2], dtype=np.uint8)
+    if threads > 1 and rgb.shape[0] > STRIP_ROWS:
+        executor = _executors.get(threads)
+        if executor is None:
+            executor = _executors[threads] = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='dither')
+        futures = [executor.submit(_dither_strip, rgb[y:y + STRIP_ROWS], out[y:y + STRIP_ROWS], lut, y, bits)
+                   for y in range(0, rgb.shape[0], STRIP_ROWS)]
+        for future in futures:
+            future.result()
+    else:
+        _dither_strip(rgb, out, lut, 0, bits)
+    result = Image.fromarray(out, 'P')
+    result.putpalette(palette_image(palette).getpalette())
+    return result
@@ -0,0 +1,129 @@
+import os
+import io
+import hashlib
+import logging
+import threading
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class CoverCache:
+    """
+    Album covers on disk, one file per cover URL and size, named after a hash
+    of both. The file mtime is the last use: a hit touches it and once the
+    files exceed max_bytes the least recently used ones are deleted.
+    Writes go to a temp file that is fsynced and renamed, a power loss leaves
+    either the old state or the complete new file.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # Temp files of writes interrupted by a power loss
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def key(url: str, variant: str) -> str:
+        """
+        File name for the cover at 'url' prepared for 'variant', e.g. the layout size.
+        """
+        return hashlib.blake2b(f'{url}#{variant}'.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str):
+        """
+        Returns the cached cover as a loaded Image, None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            image = Image.open(path)
+            image.load()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f'Discarding unreadable cached cover {path}: {e}')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def put(self, key: str, data: bytes):
+        """
+        Stores the encoded cover 'data' under 'key', then evicts down to max_bytes.
+        """
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # Make the rename itself durable
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError as e:
+            logger.warning(f'Failed to cache cover {path}: {e}')
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.tmp') or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        size = 0
+        files = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    size += entry.stat().st_size
+                    files += 1
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'files': files, 'bytes': size}
+
+
+def encode_jpeg(image: Image) -> bytes:
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
@@ -0,0 +1,65 @@
+import os
+import threading
+import collections
+from PIL import ImageFont
+
+
+class FontCache:
+    """
+    Keeps loaded FreeType fonts by (path, size, layout engine) so rendering a
+    frame does not re-open and re-parse the font file. Each lookup compares the
+    file's mtime and size with the ones seen when loading, a font replaced on
+    disk is loaded again. The least recently used font is dropped beyond max_fonts.
+    """
+
+    def __init__(self, max_fonts: int = 32):
+        self.max_fonts = max_fonts
+        self._fonts = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path: str, size: int, layout_engine=None) -> ImageFont.FreeTypeFont:
+        """
+        Returns the font like ImageFont.truetype(path, size, layout_engine=layout_engine).
+        """
+        key = (path, size, layout_engine)
+        signature = self._signature(path)
+        with self._lock:
+            entry = self._fonts.get(key)
+            if entry is not None and entry[0] == signature:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        font = ImageFont.truetype(path, size, layout_engine=layout_engine)
+        with self._lock:
+            self._fonts[key] = (signature, font)
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+        return font
+
+    def warm(self, path: str, sizes, layout_engine=None):
+        """
+        Loads 'path' at each of 'sizes' ahead of the first frame.
+        """
+        for size in sizes:
+            self.get(path, size, layout_engine)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'fonts': len(self._fonts),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# Shared by everything rendering text in this process
+shared_cache = FontCache()
@@ -0,0 +1,43 @@
+import threading
+import collections
+
+
+class LayerCache:
+    """
+    Small in-memory LRU of rendered image layers with hit/miss counters.
+    Callers that draw into a layer must work on a copy of it.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            layer = self._items.get(key)
+            if layer is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return layer
+
+    def put(self, key, layer):
+        with self._lock:
+            self._items[key] = layer
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'layers': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -34,15 +34,67 @@
 #
 
 import logging
+import time
+import numpy as np
 from . import epdconfig
 
 # Display resolution
 EPD_WIDTH = 640
 EPD_HEIGHT = 400
 
+# RGB value of every panel colour, indexed by its 4 bit colour code
+PALETTE_RGB = (
+    (0x00, 0x00, 0x00),  # 0000 black
+    (0xff, 0xff, 0xff),  # 0001 white
+    (0x00, 0xff, 0x00),  # 0010 green
+    (0x00, 0x00, 0xff),  # 0011 blue
+    (0xff, 0x00, 0x00),  # 0100 red
+    (0xff, 0xff, 0x00),  # 0101 yellow
+    (0xff, 0x80, 0x00),  # 0110 orange
+)
+
+# Constant frames, two pixels per byte
+FRAME_BYTES = EPD_WIDTH * EPD_HEIGHT // 2
+BLACK_FRAME = bytes(FRAME_BYTES)
+WHITE_FRAME = bytes([0x11]) * FRAME_BYTES
+
+# Command streams as (opcode, parameter bytes), each entry goes out as one
+# command transfer followed by one data transfer
+INIT_SEQUENCE = (
+    (0x00, b'\x2f\x00'),
+    (0x01, b'\x37\x00\x05\x05'),
+    (0x03, b'\x00'),
+    (0x06, b'\xc7\xc7\x1d'),
+    (0x41, b'\x00'),
+    (0x50, b'\x37'),
+    (0x60, b'\x22'),
+    (0x61, b'\x02\x80\x01\x90'),  # Resolution 640x400
+    (0xE3, b'\xaa'),
+)
+RESOLUTION_SEQUENCE = (
+    (0x61, b'\x02\x80\x01\x90'),  # Set Resolution setting
+)
+DEEP_SLEEP_SEQUENCE = (
+    (0x07, b'\xa5'),  # DEEP_SLEEP
+)
+
+# Default frame upload chunk, matches the spidev default bufsiz
+SPI_CHUNK_SIZE = 4096
+
+# Upper bound for a single busy wait, a full 7 colour refresh takes ~30 s
+BUSY_TIMEOUT_MS = 60000
+# Time the controller needs after DEEP_SLEEP before it may be reset or powered off
+DEEP_SLEEP_SETTLE_MS = 2000
+# Reset pulse spacing used to wake from deep sleep, init_panel() waits for BUSY anyway
+WAKE_RESET_MS = 20
+
 logger = logging.getLogger()
 
 
+class BusyTimeoutError(RuntimeError):
+    """The BUSY line did not change within EPD.busy_timeout_ms."""
+
+
 class EPD:
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
@@ -58,84 +110,158 @@ class EPD:
         self.RED = 0x0000ff  # 0100
         self.YELLOW = 0x00ffff  # 0101
         self.ORANGE = 0x0080ff  # 0110
+        # Preallocated packed frame, reused for every getbuffer call
+        self.frame_buffer = bytearray(FRAME_BYTES)
+        self.busy_timeout_ms = BUSY_TIMEOUT_MS
+        # Measured busy duration in ms of the last wait per phase
+        self.busy_times = {}
+        # GPIO writes and SPI transfers since the last reset_io_stats()
+        self.io_stats = {'gpio_writes': 0, 'spi_transfers': 0}
+        # Bytes per spi_writebyte2 call during frame uploads
+        self.spi_chunk_size = SPI_CHUNK_SIZE
+        # Size and duration of the last frame upload
+        self.upload_stats = {'bytes': 0, 'seconds': 0.0}
+
+    def reset_io_stats(self):
+        self.io_stats = {'gpio_writes': 0, 'spi_transfers': 0}
+
+    def _gpio_write(self, pin, value):
+        self.io_stats['gpio_writes'] += 1
+        epdconfig.digital_write(pin, value)
+
+    def _spi_write(self, data):
+        self.io_stats['spi_transfers'] += 1
+        if len(data) == 1:
+            epdconfig.spi_writebyte(list(data))
+        else:
+            epdconfig.spi_writebyte2(data)
 
     # Hardware reset
-    def reset(self):
-        epdconfig.digital_write(self.reset_pin, 1)
-        epdconfig.delay_ms(200)
-        epdconfig.digital_write(self.reset_pin, 0)
+    def reset(self, delay=200):
+        self._gpio_write(self.reset_pin, 1)
+        epdconfig.delay_ms(delay)
+        self._gpio_write(self.reset_pin, 0)
         epdconfig.delay_ms(1)
-        epdconfig.digital_write(self.reset_pin, 1)
-        epdconfig.delay_ms(200)
+        self._gpio_write(self.reset_pin, 1)
+        epdconfig.delay_ms(delay)
 
     def send_command(self, command):
-        epdconfig.digital_write(self.dc_pin, 0)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([command])
-        epdconfig.digital_write(self.cs_pin, 1)
+        self.send_command_data(command)
 
     def send_data(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([data])
-        epdconfig.digital_write(self.cs_pin, 1)
+        self._gpio_write(self.dc_pin, 1)
+        self._gpio_write(self.cs_pin, 0)
+        self._spi_write([data])
+        self._gpio_write(self.cs_pin, 1)
 
-    # send a lot of data
+    # send a lot of data, any bytes-like object (bytes, bytearray, memoryview)
     def send_data2(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte2(data)
-        epdconfig.digital_write(self.cs_pin, 1)
+        self._gpio_write(self.dc_pin, 1)
+        self._gpio_write(self.cs_pin, 0)
+        self._spi_write(data)
+        self._gpio_write(self.cs_pin, 1)
 
-    def ReadBusyHigh(self):
-        logger.debug("e-Paper busy")
-        while (epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)
-        logger.debug("e-Paper busy release")
+    # Opcode and all of its parameters in one CS frame: a single DC switch and
+    # one SPI transfer for the parameters instead of one per byte
+    def send_command_data(self, command, data=b''):
+        self._gpio_write(self.dc_pin, 0)
+        self._gpio_write(self.cs_pin, 0)
+        self._spi_write([command])
+        if len(data):
+            self._gpio_write(self.dc_pin, 1)
+            self._spi_write(data)
+        self._gpio_write(self.cs_pin, 1)
+
+    def send_sequence(self, sequence):
+        for command, data in sequence:
+            self.send_command_data(command, data)
 
-    def ReadBusyLow(self):
+    def _wait_busy(self, level, phase):
         logger.debug("e-Paper busy")
-        while (epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)
+        start = time.monotonic()
+        if not epdconfig.wait_for_level(self.busy_pin, level, self.busy_timeout_ms):
+            # Stuck BUSY line: reset the panel and power the module down so the
+            # next init() starts from a clean state instead of hanging forever
+            logger.error(f"e-Paper busy timeout after {self.busy_timeout_ms} ms in phase '{phase}', resetting")
+            self.reset()
+            epdconfig.module_exit()
+            raise BusyTimeoutError(f"busy timeout in phase '{phase}'")
+        self.busy_times[phase] = (time.monotonic() - start) * 1000.0
         logger.debug("e-Paper busy release")
 
+    def ReadBusyHigh(self, phase='busy'):
+        self._wait_busy(1, phase)      # 0: busy, 1: idle
+
+    def ReadBusyLow(self, phase='busy'):
+        self._wait_busy(0, phase)
+
     def init(self):
         if (epdconfig.module_init() != 0):
             return -1
         # EPD hardware init start
         self.reset()
-        self.ReadBusyHigh()
-        self.send_command(0x00)
-        self.send_data(0x2f)
-        self.send_data(0x00)
-        self.send_command(0x01)
-        self.send_data(0x37)
-        self.send_data(0x00)
-        self.send_data(0x05)
-        self.send_data(0x05)
-        self.send_command(0x03)
-        self.send_data(0x00)
-        self.send_command(0x06)
-        self.send_data(0xC7)
-        self.send_data(0xC7)
-        self.send_data(0x1D)
-        self.send_command(0x41)
-        self.send_data(0x00)
-        self.send_command(0x50)
-        self.send_data(0x37)
-        self.send_command(0x60)
-        self.send_data(0x22)
-        self.send_command(0x61)
-        self.send_data(0x02)
-        self.send_data(0x80)
-        self.send_data(0x01)
-        self.send_data(0x90)
-        self.send_command(0xE3)
-        self.send_data(0xAA)
-        # EPD hardware init end
+        self.init_panel()
         return 0
 
+    # Controller setup after a hardware reset, SPI and GPIO must already be open
+    def init_panel(self):
+        self.ReadBusyHigh('reset')
+        self.send_sequence(INIT_SEQUENCE)
+
+    def _rgb_to_codes(self, image):
+        # Map every RGB pixel to its colour code, unknown colours become black (0)
+        pixels = np.asarray(image, dtype=np.uint32)
+        rgb = (pixels[:, :, 0] << 16) | (pixels[:, :, 1] << 8) | pixels[:, :, 2]
+        codes = np.zeros(rgb.shape, dtype=np.uint8)
+        for code, (r, g, b) in enumerate(PALETTE_RGB[1:], start=1):
+            codes[rgb == ((r << 16) | (g << 8) | b)] = code
+        return codes
+
+    def _pack_rows(self, codes, first, last):
+        # Two pixels per byte, left pixel in the high nibble, packed into the
+        # reusable frame buffer
+        packed = np.frombuffer(self.frame_buffer, dtype=np.uint8).reshape(self.height, self.width // 2)
+        np.left_shift(codes[first:last, 0::2], 4, out=packed[first:last])
+        np.bitwise_or(packed[first:last], codes[first:last, 1::2], out=packed[first:last])
+
+    def _panel_codes(self, codes):
+        # Portrait frames are rotated as one bulk array operation (np.rot90 is
+        # the same mapping as newx = y, newy = height - x - 1 per pixel).
+        # Returns None for frames of any other size
+        imheight, imwidth = codes.shape
+        if (imwidth == self.width and imheight == self.height):
+            return codes
+        elif (imwidth == self.height and imheight == self.width):
+            return np.rot90(codes)
+        return None
+
+    def _codes_to_buffer(self, codes):
+        codes = self._panel_codes(codes)
+        if codes is None:
+            return BLACK_FRAME
+        self._pack_rows(codes, 0, self.height)
+        return memoryview(self.frame_buffer)
+
+    def _index_codes(self, indices, width, height):
+        # 'P' images quantized to PALETTE_RGB: the palette indices already are
+        # the colour codes, only out of range entries (black) are remapped
+        codes = np.frombuffer(indices, dtype=np.uint8).reshape(height, width)
+        out_of_range = codes >= len(PALETTE_RGB)
+        if out_of_range.any():
+            codes = np.where(out_of_range, 0, codes).astype(np.uint8)
+        return codes
+
+    # The returned memoryview shares the EPD frame buffer and stays valid
+    # until the next getbuffer call
     def getbuffer(self, image):
+        image_monocolor = image.convert('RGB')  # Picture mode conversion
+        return self._codes_to_buffer(self._rgb_to_codes(image_monocolor))
+
+    def getbuffer_indices(self, indices, width, height):
+        return self._codes_to_buffer(self._index_codes(indices, width, height))
+
+    def getbuffer_legacy(self, image):
+        # Reference per-pixel implementation, kept for benchmark.py
         buf = [0x00] * int(self.width * self.height / 2)
         image_monocolor = image.convert('RGB')  # Picture mode conversion
         imwidth, imheight = image_monocolor.size
@@ -187,30 +313,40 @@ class EPD:
                     buf[Add] = data_t | ((Color << 4) >> ((newx % 2) * 4))
         return buf
 
-    def display(self, image):
-        self.send_command(0x61)  # Set Resolution setting
-        self.send_data(0x02)
-        self.send_data(0x80)
-        self.send_data(0x01)
-        self.send_data(0x90)
-        self.send_command(0x10)
-        self.send_data2(image)
+    def _refresh(self):
         self.send_command(0x04)  # 0x04
-        self.ReadBusyHigh()
+        self.ReadBusyHigh('power_on')
         self.send_command(0x12)  # 0x12
-        self.ReadBusyHigh()
+        self.ReadBusyHigh('refresh')
         self.send_command(0x02)  # 0x02
-        self.ReadBusyLow()
+        self.ReadBusyLow('power_off')
         # epdconfig.delay_ms(500)
 
-    def Clear(self):
-        self.send_command(0x61)  # Set Resolution setting
-        self.send_data(0x02)
-        self.send_data(0x80)
-        self.send_data(0x01)
-        self.send_data(0x90)
+    def _chunks(self, data):
+        view = memoryview(data)
+        for offset in range(0, len(view), self.spi_chunk_size):
+            yield view[offset:offset + self.spi_chunk_size]
+
+    # Frame upload (0x10), DC stays high over all chunks. The timing ends up in
+    # upload_stats
+    def send_frame(self, chunks):
         self.send_command(0x10)
-        self.send_data2([0x11] * int(EPD_HEIGHT) * int(EPD_WIDTH / 2))
+        self._gpio_write(self.dc_pin, 1)
+        self._gpio_write(self.cs_pin, 0)
+        start = time.monotonic()
+        sent = 0
+        for chunk in chunks:
+            self._spi_write(chunk)
+            sent += len(chunk)
+        self.upload_stats = {'bytes': sent, 'seconds': time.monotonic() - start}
+        self._gpio_write(self.cs_pin, 1)
+
+    def display(self, image):
+        self.send_sequence(RESOLUTION_SEQUENCE)
+        self.send_frame(self._chunks(image))
+        self._refresh()
+
+    def Clear(self):
         # BLACK   0x00    /// 0000
         # WHITE   0x11    /// 0001
         # GREEN   0x22    /// 0010
@@ -219,17 +355,88 @@ class EPD:
         # YELLOW  0x55    /// 0101
         # ORANGE  0x66    /// 0110
         # CLEAN   0x77    /// 0111   unavailable  Afterimage
-        self.send_command(0x04)  # 0x04
-        self.ReadBusyHigh()
-        self.send_command(0x12)  # 0x12
-        self.ReadBusyHigh()
-        self.send_command(0x02)  # 0x02
-        self.ReadBusyLow()
-        # epdconfig.delay_ms(500)
+        self.send_sequence(RESOLUTION_SEQUENCE)
+        self.send_frame(self._chunks(WHITE_FRAME))
+        self._refresh()
 
     def sleep(self):
         # epdconfig.delay_ms(500)
-        self.send_command(0x07)  # DEEP_SLEEP
-        self.send_data(0XA5)
+        self.send_sequence(DEEP_SLEEP_SEQUENCE)
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
+
+
+class PanelSession:
+    """
+    Long lived handle on the panel. SPI and GPIO stay open between frames and
+    the session tracks whether the controller is in deep sleep, so a frame
+    costs a short wake reset instead of module_init + full reset, and the
+    deep sleep settle time is only waited for when the panel is touched again.
+    """
+
+    def __init__(self, epd=None):
+        self.epd = epd or EPD()
+        self.module_open = False
+        # State at start is unknown, treat it like a sleeping panel
+        self.asleep = True
+        self.sleep_started = None
+
+    def _settle(self):
+        # Let a previous DEEP_SLEEP complete before reset or power off
+        if self.sleep_started is None:
+            return
+        remaining_ms = DEEP_SLEEP_SETTLE_MS - (time.monotonic() - self.sleep_started) * 1000.0
+        if remaining_ms > 0:
+            epdconfig.delay_ms(remaining_ms)
+        self.sleep_started = None
+
+    def _run(self, func, *args):
+        try:
+            return func(*args)
+        except BusyTimeoutError:
+            # EPD already reset the panel and called module_exit
+            self.module_open = False
+            self.asleep = True
+            self.sleep_started = None
+            raise
+
+    def wake(self):
+        if not self.module_open:
+            if (epdconfig.module_init() != 0):
+                raise RuntimeError("e-Paper module init failed")
+            self.module_open = True
+        if self.asleep:
+            self._settle()
+            self.epd.reset(WAKE_RESET_MS)
+            self._run(self.epd.init_panel)
+            self.asleep = False
+
+    def _start_refresh(self):
+        # Stats cover this refresh only, a frame that skips the wake reset
+        # must not report the busy time of an earlier one
+        self.epd.reset_io_stats()
+        self.epd.busy_times = {}
+
+    def display(self, buf):
+        self._start_refresh()
+        self.wake()
+        self._run(self.epd.display, buf)
+
+    def clear(self):
+        self._start_refresh()
+        self.wake()
+        self._run(self.epd.Clear)
+
+    def sleep(self):
+        # Send DEEP_SLEEP and return right away, the settle time is paid lazily
+        if self.module_open and not self.asleep:
+            self.epd.send_sequence(DEEP_SLEEP_SEQUENCE)
+            self.asleep = True
+            self.sleep_started = time.monotonic()
+
+    def close(self):
+        if self.module_open:
+            self.sleep()
+            self._settle()
+            epdconfig.module_exit()
+            self.module_open = False
@@ -40,14 +40,45 @@ import time
 
 logger = logging.getLogger()
 
+# Poll interval of the BUSY line where GPIO edge detection is unavailable
+BUSY_POLL_MS = 10
+
+
+def _wait_for_level(backend, pin, level, timeout_ms):
+    # Block on a GPIO edge instead of polling, returns False on timeout.
+    # The wait is sliced so an edge just before wait_for_edge cannot be missed for long.
+    # Edge detection raises RuntimeError on some kernels (e.g. RPi.GPIO on 6.6+),
+    # the backend then polls the line for the rest of its life
+    edge = backend.GPIO.RISING if level else backend.GPIO.FALLING
+    deadline = time.monotonic() + timeout_ms / 1000.0
+    while backend.GPIO.input(pin) != level:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            return False
+        if backend.edge_detection:
+            try:
+                backend.GPIO.wait_for_edge(pin, edge, timeout=min(remaining_ms, 1000))
+                continue
+            except RuntimeError as e:
+                logger.warning(f"GPIO edge detection unavailable ({e}), polling the BUSY line")
+                backend.edge_detection = False
+        time.sleep(min(remaining_ms, BUSY_POLL_MS) / 1000.0)
+    return True
+
 
 class RaspberryPi:
+    # Cleared once wait_for_edge fails, see _wait_for_level
+    edge_detection = True
     # Pin definition
     RST_PIN = 17
     DC_PIN = 25
     CS_PIN = 8
     BUSY_PIN = 24
     PWR_PIN = 18
+    # SPI clock, see set_spi_speed
+    _spi_speed_hz = 4000000
+    # True between module_init() and module_exit()
+    _spi_open = False
 
     def __init__(self):
         import spidev
@@ -64,12 +95,21 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, level, timeout_ms):
+        return _wait_for_level(self, pin, level, timeout_ms)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
         self.SPI.writebytes2(data)
 
+    def set_spi_speed(self, speed_hz):
+        # Applied right away while SPI is open, otherwise by the next module_init()
+        self._spi_speed_hz = int(speed_hz)
+        if self._spi_open:
+            self.SPI.max_speed_hz = self._spi_speed_hz
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -82,13 +122,15 @@ class RaspberryPi:
 
         # SPI device, bus = 0, device = 0
         self.SPI.open(0, 0)
-        self.SPI.max_speed_hz = 4000000
+        self.SPI.max_speed_hz = self._spi_speed_hz
         self.SPI.mode = 0b00
+        self._spi_open = True
         return 0
 
     def module_exit(self):
         logger.debug("spi end")
         self.SPI.close()
+        self._spi_open = False
         logger.debug("close 5V, Module enters 0 power consumption ...")
         self.GPIO.output(self.RST_PIN, 0)
         self.GPIO.output(self.DC_PIN, 0)
@@ -97,14 +139,35 @@ class RaspberryPi:
 
 
 class JetsonNano:
+    # Cleared once wait_for_edge fails, see _wait_for_level
+    edge_detection = True
     # Pin definition
     RST_PIN = 17
     DC_PIN = 25
     CS_PIN = 8
     BUSY_PIN = 24
     PWR_PIN = 18
+    # Hardware SPI device, present once the header's SPI pins are enabled (jetson-io)
+    SPIDEV_PATH = '/dev/spidev0.0'
+    # SPI clock, see set_spi_speed
+    _spi_speed_hz = 4000000
+    # True between module_init() and module_exit()
+    _spi_open = False
 
     def __init__(self):
+        import Jetson.GPIO
+        self.GPIO = Jetson.GPIO
+        # Hardware SPI sends a whole chunk per call, the software SPI library
+        # needs one foreign call per byte
+        self.hardware_spi = False
+        if os.path.exists(self.SPIDEV_PATH):
+            try:
+                import spidev
+                self.SPI = spidev.SpiDev()
+                self.hardware_spi = True
+                return
+            except ImportError:
+                logger.warning(f"{self.SPIDEV_PATH} exists but spidev is not installed, using software SPI")
         import ctypes
         find_dirs = [
             os.path.dirname(os.path.realpath(__file__)),
@@ -119,8 +182,6 @@ class JetsonNano:
                 break
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
-        import Jetson.GPIO
-        self.GPIO = Jetson.GPIO
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -131,12 +192,29 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, level, timeout_ms):
+        return _wait_for_level(self, pin, level, timeout_ms)
+
     def spi_writebyte(self, data):
-        self.SPI.SYSFS_software_spi_transfer(data[0])
+        if self.hardware_spi:
+            self.SPI.writebytes(data)
+        else:
+            self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        if self.hardware_spi:
+            self.SPI.writebytes2(data)
+            return
+        transfer = self.SPI.SYSFS_software_spi_transfer
+        for value in data:
+            transfer(value)
+
+    def set_spi_speed(self, speed_hz):
+        # Applied right away while SPI is open, otherwise by the next module_init().
+        # Software SPI has no clock to set
+        self._spi_speed_hz = int(speed_hz)
+        if self._spi_open:
+            self.SPI.max_speed_hz = self._spi_speed_hz
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -147,12 +225,23 @@ class JetsonNano:
         self.GPIO.setup(self.PWR_PIN, self.GPIO.OUT)
         self.GPIO.setup(self.BUSY_PIN, self.GPIO.IN)
         self.GPIO.output(self.PWR_PIN, 1)
-        self.SPI.SYSFS_software_spi_begin()
+        if self.hardware_spi:
+            # SPI device, bus = 0, device = 0
+            self.SPI.open(0, 0)
+            self.SPI.max_speed_hz = self._spi_speed_hz
+            self.SPI.mode = 0b00
+            self._spi_open = True
+        else:
+            self.SPI.SYSFS_software_spi_begin()
         return 0
 
     def module_exit(self):
         logger.debug("spi end")
-        self.SPI.SYSFS_software_spi_end()
+        if self.hardware_spi:
+            self.SPI.close()
+            self._spi_open = False
+        else:
+            self.SPI.SYSFS_software_spi_end()
         logger.debug("close 5V, Module enters 0 power consumption ...")
         self.GPIO.output(self.RST_PIN, 0)
         self.GPIO.output(self.DC_PIN, 0)
@@ -161,12 +250,18 @@ class JetsonNano:
 
 
 class SunriseX3:
+    # Cleared once wait_for_edge fails, see _wait_for_level
+    edge_detection = True
     # Pin definition
     RST_PIN = 17
     DC_PIN = 25
     CS_PIN = 8
     BUSY_PIN = 24
     PWR_PIN = 18
+    # SPI clock, see set_spi_speed
+    _spi_speed_hz = 4000000
+    # True between module_init() and module_exit()
+    _spi_open = False
     Flag = 0
 
     def __init__(self):
@@ -184,13 +279,23 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, level, timeout_ms):
+        return _wait_for_level(self, pin, level, timeout_ms)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
         # for i in range(len(data)):
         #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        # writebytes2 takes bytes-like objects as is, xfer3 converted them to a list
+        self.SPI.writebytes2(data)
+
+    def set_spi_speed(self, speed_hz):
+        # Applied right away while SPI is open, otherwise by the next module_init()
+        self._spi_speed_hz = int(speed_hz)
+        if self._spi_open:
+            self.SPI.max_speed_hz = self._spi_speed_hz
 
     def module_init(self):
         if self.Flag == 0:
@@ -205,8 +310,9 @@ class SunriseX3:
             self.GPIO.output(self.PWR_PIN, 1)
             # SPI device, bus = 0, device = 0
             self.SPI.open(2, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self._spi_speed_hz
             self.SPI.mode = 0b00
+            self._spi_open = True
             return 0
         else:
             return 0
@@ -214,6 +320,7 @@ class SunriseX3:
     def module_exit(self):
         logger.debug("spi end")
         self.SPI.close()
+        self._spi_open = False
         logger.debug("close 5V, Module enters 0 power consumption ...")
         self.Flag = 0
         self.GPIO.output(self.RST_PIN, 0)
@@ -232,7 +339,11 @@ def is_raspberry_pi():
     return re.search(r"^Model\s*:\s*Raspberry Pi", cpuinfo, flags=re.M) is not None
 
 
-if is_raspberry_pi():
+if os.environ.get('EPD_BACKEND') == 'virtual':
+    # Simulated panel for running without hardware
+    from .epdvirtual import Virtual
+    implementation = Virtual()
+elif is_raspberry_pi():
     implementation = RaspberryPi()
 elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
     implementation = SunriseX3()
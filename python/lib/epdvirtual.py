@@ -0,0 +1,184 @@
+# *****************************************************************************
+# * | File        :   epdvirtual.py
+# * | Function    :   Simulated hardware interface for the Waveshare drivers
+# * | Info        :   selected by epdconfig when EPD_BACKEND=virtual is set,
+# *                   lets the display pipeline run on a machine without a panel
+# ******************************************************************************
+
+import os
+import time
+import logging
+import collections
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Virtual:
+    # Pin definition, same numbering as the hardware backends
+    RST_PIN = 17
+    DC_PIN = 25
+    CS_PIN = 8
+    BUSY_PIN = 24
+    PWR_PIN = 18
+
+    # Controller opcodes the simulation reacts to
+    CMD_RESOLUTION = 0x61
+    CMD_DATA_START = 0x10
+    CMD_POWER_ON = 0x04
+    CMD_REFRESH = 0x12
+    CMD_POWER_OFF = 0x02
+
+    def __init__(self):
+        self.output_dir = None
+        self.spi_speed_hz = 4000000
+        # Simulated busy durations in ms
+        self.busy_ms = {
+            'reset': 10,
+            'power_on': 100,
+            'refresh': 30000,
+            'power_off': 100,
+        }
+        self.pins = {self.RST_PIN: 1, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        # BUSY is low while the controller works, except during power off where it
+        # stays high until the panel is off (see EPD.ReadBusyLow)
+        self.busy_until = 0.0
+        self.busy_level_after = 1
+        self.width = 640
+        self.height = 400
+        self.command = None
+        self.params = bytearray()
+        self.frame = bytearray()
+        # Recent transfers as (kind, opcode or length), kind is 'command' or 'data'
+        self.transfers = collections.deque(maxlen=1000)
+        self.stats = {
+            'commands': 0,
+            'data_transfers': 0,
+            'data_bytes': 0,
+            'frames': 0,
+            'busy_ms': 0.0,
+        }
+
+    def configure(self, output_dir=None, **busy_ms):
+        """
+        Sets the PNG output directory and simulated busy durations, e.g.
+        configure('/tmp/frames', refresh=15000).
+        """
+        self.output_dir = output_dir
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        for phase, ms in busy_ms.items():
+            if phase not in self.busy_ms:
+                raise ValueError(f"Unknown busy phase: {phase}")
+            self.busy_ms[phase] = ms
+
+    def _start_busy(self, phase, level_after=1):
+        duration_ms = self.busy_ms[phase]
+        self.busy_until = time.monotonic() + duration_ms / 1000.0
+        self.busy_level_after = level_after
+        self.stats['busy_ms'] += duration_ms
+
+    def _busy_level(self):
+        if time.monotonic() < self.busy_until:
+            return 1 - self.busy_level_after
+        return self.busy_level_after
+
+    def digital_write(self, pin, value):
+        if pin == self.RST_PIN and value and not self.pins.get(pin):
+            # Rising edge on RST ends the reset pulse
+            self._start_busy('reset')
+        self.pins[pin] = value
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return self._busy_level()
+        return self.pins.get(pin, 0)
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime / 1000.0)
+
+    def wait_for_level(self, pin, level, timeout_ms):
+        if pin != self.BUSY_PIN:
+            raise ValueError(f"wait_for_level only supports the busy pin, got {pin}")
+        if self._busy_level() == level:
+            return True
+        if level != self.busy_level_after:
+            # The simulated BUSY line never goes back, behave like a stuck pin
+            time.sleep(timeout_ms / 1000.0)
+            return False
+        remaining = self.busy_until - time.monotonic()
+        if remaining * 1000.0 > timeout_ms:
+            time.sleep(timeout_ms / 1000.0)
+            return False
+        time.sleep(max(remaining, 0))
+        return True
+
+    def spi_writebyte(self, data):
+        self._transfer(data)
+
+    def spi_writebyte2(self, data):
+        self._transfer(data)
+
+    def _transfer(self, data):
+        if self.pins[self.DC_PIN] == 0:
+            for opcode in bytes(data):
+                self._command(opcode)
+            return
+        self.transfers.append(('data', len(data)))
+        self.stats['data_transfers'] += 1
+        self.stats['data_bytes'] += len(data)
+        if self.command == self.CMD_DATA_START:
+            self.frame += bytes(data)
+        else:
+            self.params += bytes(data)
+            if self.command == self.CMD_RESOLUTION and len(self.params) == 4:
+                self.width = (self.params[0] << 8) | self.params[1]
+                self.height = (self.params[2] << 8) | self.params[3]
+
+    def _command(self, opcode):
+        self.transfers.append(('command', opcode))
+        self.stats['commands'] += 1
+        self.command = opcode
+        self.params = bytearray()
+        if opcode == self.CMD_DATA_START:
+            self.frame = bytearray()
+        elif opcode == self.CMD_POWER_ON:
+            self._start_busy('power_on')
+        elif opcode == self.CMD_REFRESH:
+            self._start_busy('refresh')
+            self.stats['frames'] += 1
+            self._write_frame()
+        elif opcode == self.CMD_POWER_OFF:
+            self._start_busy('power_off', level_after=0)
+
+    def _write_frame(self):
+        if not self.output_dir:
+            return
+        if len(self.frame) != self.width * self.height // 2:
+            logger.warning(f"Virtual panel: incomplete frame of {len(self.frame)} bytes")
+            return
+        from PIL import Image
+        from .epd4in01f import PALETTE_RGB
+        packed = np.frombuffer(bytes(self.frame), dtype=np.uint8)
+        codes = np.empty(packed.size * 2, dtype=np.uint8)
+        codes[0::2] = packed >> 4
+        codes[1::2] = packed & 0x0F
+        # Codes 7 (clean) and above have no colour, show them as white
+        palette = np.array(PALETTE_RGB + ((0xff, 0xff, 0xff),) * 9, dtype=np.uint8)
+        pixels = palette[codes].reshape(self.height, self.width, 3)
+        path = os.path.join(self.output_dir, f"frame_{self.stats['frames']:05d}.png")
+        Image.fromarray(pixels, 'RGB').save(path)
+        logger.debug(f"Virtual panel: wrote {path}")
+
+    def set_spi_speed(self, speed_hz):
+        self.spi_speed_hz = int(speed_hz)
+
+    def module_init(self):
+        self.pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self):
+        logger.debug("virtual panel: module exit")
+        self.pins[self.RST_PIN] = 0
+        self.pins[self.DC_PIN] = 0
+        self.pins[self.PWR_PIN] = 0
@@ -0,0 +1,126 @@
+import os
+import configparser
+
+# Values accepted for the enumerated eink_options.ini settings
+MODELS = ('inky', 'waveshare4', 'virtual')
+ORIENTATIONS = ('landscape', 'portrait')
+TEXT_DIRECTIONS = ('top-down', 'bottom-up')
+TEXT_LAYOUTS = ('wrap', 'fit')
+DITHER_MODES = ('floyd-steinberg', 'ordered', 'none')
+BACKGROUND_MODES = ('fit', 'repeat')
+
+
+class RenderSettings:
+    """
+    Read-only snapshot of the eink_options.ini values the render and display
+    path needs, parsed and validated once. A reload builds a new object and
+    swaps it in, a frame already being rendered keeps using the old one.
+    """
+
+    __slots__ = (
+        'model', 'width', 'height', 'orientation', 'frame_size',
+        'album_cover_small', 'album_cover_small_px',
+        'offset_px_left', 'offset_px_right', 'offset_px_top', 'offset_px_bottom',
+        'offset_text_px_shadow', 'text_direction',
+        'text_layout', 'text_max_lines', 'font_size_min',
+        'background_mode', 'background_blur',
+        'font_path', 'font_size_title', 'font_size_artist',
+        'display_refresh_counter', 'refresh_skip_threshold',
+        'busy_timeout', 'spi_speed_hz', 'spi_chunk_size',
+        'dither', 'color_saturation', 'lut_cache_dir',
+    )
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'RenderSettings is read-only, cannot set {name}')
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'RenderSettings({values})'
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser, section: str = 'DEFAULT') -> 'RenderSettings':
+        """
+        Parses 'section' of an eink_options.ini, raises ValueError for values out of range.
+        """
+        get = config[section].get
+        getint = config[section].getint
+        getboolean = config[section].getboolean
+
+        def choice(key: str, allowed: tuple, fallback: str = None) -> str:
+            value = get(key, fallback=fallback)
+            if value not in allowed:
+                raise ValueError(f"{key} must be one of {', '.join(allowed)}, got {value!r}")
+            return value
+
+        def required(key: str, getter=get):
+            value = getter(key)
+            if value is None:
+                raise configparser.NoOptionError(key, section)
+            return value
+
+        def non_negative(key: str, value):
+            if value < 0:
+                raise ValueError(f'{key} must not be negative, got {value}')
+            return value
+
+        def positive(key: str, value):
+            if value <= 0:
+                raise ValueError(f'{key} must be greater than 0, got {value}')
+            return value
+
+        width = positive('width', required('width', getint))
+        height = positive('height', required('height', getint))
+        orientation = choice('orientation', ORIENTATIONS, fallback='landscape')
+        # width and height describe the panel, portrait installs compose swapped
+        frame_size = (height, width) if orientation == 'portrait' else (width, height)
+
+        return cls(
+            model=choice('model', MODELS),
+            width=width,
+            height=height,
+            orientation=orientation,
+            frame_size=frame_size,
+            album_cover_small=required('album_cover_small', getboolean),
+            album_cover_small_px=non_negative('album_cover_small_px', required('album_cover_small_px', getint)),
+            offset_px_left=required('offset_px_left', getint),
+            offset_px_right=required('offset_px_right', getint),
+            offset_px_top=required('offset_px_top', getint),
+            offset_px_bottom=required('offset_px_bottom', getint),
+            offset_text_px_shadow=non_negative('offset_text_px_shadow', getint('offset_text_px_shadow', fallback=0)),
+            text_direction=choice('text_direction', TEXT_DIRECTIONS, fallback='top-down'),
+            text_layout=choice('text_layout', TEXT_LAYOUTS, fallback='wrap'),
+            text_max_lines=positive('text_max_lines', getint('text_max_lines', fallback=2)),
+            font_size_min=positive('font_size_min', getint('font_size_min', fallback=12)),
+            background_mode=choice('background_mode', BACKGROUND_MODES, fallback='fit'),
+            background_blur=non_negative('background_blur', getint('background_blur', fallback=0)),
+            font_path=required('font_path'),
+            font_size_title=positive('font_size_title', required('font_size_title', getint)),
+            font_size_artist=positive('font_size_artist', required('font_size_artist', getint)),
+            display_refresh_counter=getint('display_refresh_counter', fallback=20),
+            refresh_skip_threshold=non_negative('refresh_skip_threshold',
+                                                config[section].getfloat('refresh_skip_threshold', fallback=0.0)),
+            busy_timeout=positive('busy_timeout', getint('busy_timeout', fallback=60)),
+            spi_speed_hz=positive('spi_speed_hz', getint('spi_speed_hz', fallback=4000000)),
+            spi_chunk_size=positive('spi_chunk_size', getint('spi_chunk_size', fallback=4096)),
+            dither=choice('dither', DITHER_MODES, fallback='floyd-steinberg'),
+            color_saturation=non_negative('color_saturation', config[section].getfloat('color_saturation', fallback=2.0)),
+            lut_cache_dir=get('lut_cache_dir', fallback=os.path.join(os.path.dirname(__file__), '..', 'config', '.lut_cache')),
+        )
+
+    def layer_key(self) -> tuple:
+        """
+        The settings the background and small cover layer depends on.
+        """
+        return (self.frame_size, self.background_mode, self.background_blur,
+                self.album_cover_small, self.album_cover_small_px, self.offset_px_top)
+
+    def requires_restart(self, other: 'RenderSettings') -> list:
+        """
+        Names of the settings that differ from 'other' but only take effect
+        after a restart, the panel driver is set up for model and size once.
+        """
+        return [name for name in ('model', 'width', 'height') if getattr(self, name) != getattr(other, name)]
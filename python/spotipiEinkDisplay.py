@@ -10,7 +10,42 @@ import configparser
 import requests
 import signal
 import random
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageEnhance, ImageFilter
+import threading
+import hashlib
+import json
+import io
+import math
+import collections
+import numpy as np
+from PIL import Image, ImageFont, ImageFilter
+from renderSettings import RenderSettings
+import fontCache
+import textLayout
+import colorQuantizer
+import coverCache
+import layerCache
+
+# Models driven through the Waveshare 4" driver, 'virtual' simulates the panel
+WAVESHARE_MODELS = ('waveshare4', 'virtual')
+
+# Downscales first shrink by an integer factor while the image is more than this
+# many times the target size, then resample (Pillow's resize/draft reducing_gap)
+REDUCING_GAP = 3.0
+
+# Background blurs run on the background shrunk by radius // BLUR_STEP and are
+# scaled back up, a large radius then costs about as much as a small one
+BLUR_STEP = 3
+
+# A rendered frame. For a playing track 'layer' is the cached album layer it was
+# drawn on, 'layer_key' its album layer cache key and 'dirty_box' the
+# (left, top, right, bottom) box the text changed, all None for other frames
+Frame = collections.namedtuple('Frame', 'image layer_key layer dirty_box')
+
+# Outcomes of showing a frame
+FRAME_SHOWN = 'shown'
+FRAME_SKIPPED = 'skipped'
+FRAME_FAILED = 'failed'
+
 
 # Recursion limiter to avoid infinite loops in _get_song_info()
 def limit_recursion(limit):
@@ -27,15 +62,115 @@ def limit_recursion(limit):
         return wrapper
     return inner
 
+class DisplayWorker:
+    """
+    Shows frames on a background thread through a single slot mailbox.
+    show_frame(frame) returns FRAME_SHOWN, FRAME_SKIPPED or FRAME_FAILED,
+    an exception it raises counts as failed.
+    A frame submitted while another one is still waiting replaces it, so once
+    the panel is free it always gets the newest frame ("latest frame wins").
+    """
+
+    def __init__(self, show_frame, logger):
+        self._show_frame = show_frame
+        self.logger = logger
+        self._cond = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='display-worker', daemon=True)
+        self.submitted = 0
+        self.shown = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> bool:
+        """
+        Asks the worker to exit after the current frame. Returns False if it is still running.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        Blocks until no frame is waiting or being shown. Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def submit(self, frame):
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = frame
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'queue_depth': 0 if self._pending is None else 1,
+                'submitted': self.submitted,
+                'shown': self.shown,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                frame, self._pending = self._pending, None
+                self._busy = True
+            try:
+                result = self._show_frame(frame)
+            except Exception as e:
+                result = FRAME_FAILED
+                self.logger.error(f'Display worker error: {e}')
+                self.logger.error(traceback.format_exc())
+            with self._cond:
+                self._busy = False
+                if result == FRAME_SHOWN:
+                    self.shown += 1
+                elif result == FRAME_SKIPPED:
+                    self.skipped += 1
+                else:
+                    self.failed += 1
+                self._cond.notify_all()
+            stats = self.stats()
+            self.logger.info(f"Display worker: {stats['shown']} shown, {stats['skipped']} skipped, "
+                             f"{stats['failed']} failed, "
+                             f"{stats['dropped']} dropped, queue depth {stats['queue_depth']}")
+
+
 class SpotipiEinkDisplay:
-    def __init__(self, delay=1):
-        # Handle system signals
+    def __init__(self, delay=1, config_file=None):
+        # Handle system signals, SIGHUP reloads the config between two polls
+        self.reload_requested = False
         signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGHUP, self._handle_sighup)
 
         self.delay = delay
         self.config = configparser.ConfigParser()
-        # Reads ../config/eink_options.ini relative to this Python file's location
-        self.config.read(os.path.join(os.path.dirname(__file__), '..', 'config', 'eink_options.ini'))
+        # Reads ../config/eink_options.ini relative to this Python file's location by default
+        if config_file is None:
+            config_file = os.path.join(os.path.dirname(__file__), '..', 'config', 'eink_options.ini')
+        self.config_file = config_file
+        self.config.read(config_file)
+        # Everything the render and display path needs, parsed once
+        self.settings = RenderSettings.from_config(self.config)
 
         # ---------------------------------------------------------------------
         # "idle" features
@@ -74,20 +209,73 @@ class SpotipiEinkDisplay:
         # ---------------------------------------------------------------------
         # Set up display model
         # ---------------------------------------------------------------------
-        if self.config.get('DEFAULT', 'model') == 'inky':
+        if self.settings.model == 'inky':
             from inky.auto import auto
             from inky.inky_uc8159 import CLEAN
             self.inky_auto = auto
             self.inky_clean = CLEAN
+            self.inky = None
             self.logger.info('Loading Pimoroni Inky library')
-        elif self.config.get('DEFAULT', 'model') == 'waveshare4':
+        elif self.settings.model in WAVESHARE_MODELS:
+            if self.settings.model == 'virtual':
+                # Simulated Waveshare panel, must be selected before epdconfig is imported
+                os.environ['EPD_BACKEND'] = 'virtual'
             from lib import epd4in01f
             self.wave4 = epd4in01f
+            if self.settings.model == 'virtual':
+                epd4in01f.epdconfig.implementation.configure(
+                    output_dir=self.config.get('DEFAULT', 'virtual_output',
+                                               fallback=os.path.join(os.path.dirname(__file__), '..', 'virtual_output')),
+                    reset=self.config.getint('DEFAULT', 'virtual_reset_ms', fallback=10),
+                    power_on=self.config.getint('DEFAULT', 'virtual_power_on_ms', fallback=100),
+                    refresh=self.config.getint('DEFAULT', 'virtual_refresh_ms', fallback=30000),
+                    power_off=self.config.getint('DEFAULT', 'virtual_power_off_ms', fallback=100)
+                )
+                self.logger.info('Using the virtual Waveshare panel')
+            # Long lived session, SPI stays open and the panel sleeps between frames
+            self.panel = epd4in01f.PanelSession()
+            self._apply_panel_settings()
             self.logger.info('Loading Waveshare 4" library')
 
-        # Track previous song and how many times we've refreshed
+        # Track previous song and how many times we've refreshed.
+        # The display state remembers the hash of the frame on the panel across restarts
         self.song_prev = ''
-        self.pic_counter = 0
+        self.display_state_file = self.config.get(
+            'DEFAULT', 'display_state_file',
+            fallback=os.path.join(os.path.dirname(__file__), '..', 'config', '.display_state.json'))
+        self.display_state = self._load_display_state()
+        self.pic_counter = self.display_state.get('pic_counter', 0)
+        self.last_frame = None
+        # Palette lookup tables for dither = ordered or none, loaded on first use
+        self._luts = {}
+
+        # Album covers fetched before, kept on disk at the size the layout needs
+        cover_cache_mb = self.config.getfloat('DEFAULT', 'cover_cache_mb', fallback=50)
+        self.cover_cache = None
+        if cover_cache_mb > 0:
+            try:
+                self.cover_cache = coverCache.CoverCache(
+                    self.config.get('DEFAULT', 'cover_cache_dir',
+                                    fallback=os.path.join(os.path.dirname(__file__), '..', 'config', '.cover_cache')),
+                    int(cover_cache_mb * 1024 * 1024))
+            except OSError as e:
+                self.logger.error(f'Cover cache disabled: {e}')
+
+        # Finished background plus small cover per album, tiled and blurred backgrounds
+        # by content, and how long the parts of the last frame took
+        self.album_layers = layerCache.LayerCache(8)
+        self.tile_layers = layerCache.LayerCache(2)
+        self.blur_layers = layerCache.LayerCache(4)
+        # Palette indices of album layers, a new title only quantizes its text box
+        self.quantized_layers = layerCache.LayerCache(4)
+        self.render_timings = {}
+
+        # Fonts are loaded once and shared by all frames
+        self.font_cache = fontCache.shared_cache
+        self._warm_fonts()
+
+        # Panel refreshes run in the background so polling never stalls
+        self.display_worker = DisplayWorker(self._display_frame, self.logger)
 
     def _init_logger(self):
         """
@@ -104,8 +292,79 @@ class SpotipiEinkDisplay:
 
     def _handle_sigterm(self, sig, frame):
         self.logger.warning('SIGTERM received, stopping')
+        self._close_panel()
         sys.exit(0)
 
+    def _handle_sighup(self, sig, frame):
+        # Runs on the main thread, possibly inside a cache lock: only flag the
+        # reload, the main loop performs it between polls
+        self.reload_requested = True
+
+    def _apply_pending_reload(self):
+        """
+        Reloads the config if a SIGHUP arrived since the last poll.
+        """
+        if self.reload_requested:
+            self.reload_requested = False
+            self.logger.info('SIGHUP received, reloading config')
+            self._reload_config()
+
+    def _reload_config(self):
+        """
+        Re-reads the config file and swaps in new render settings in one assignment.
+        An invalid file keeps the current settings.
+        """
+        config = configparser.ConfigParser()
+        try:
+            config.read(self.config_file)
+            settings = RenderSettings.from_config(config)
+        except Exception as e:
+            self.logger.error(f'Config reload failed, keeping the current settings: {e}')
+            return
+        restart_needed = settings.requires_restart(self.settings)
+        if restart_needed:
+            self.logger.warning(f"Config reload ignored, changing {', '.join(restart_needed)} needs a restart")
+            return
+        self.config = config
+        self.settings = settings
+        self._apply_panel_settings()
+        self._warm_fonts()
+        self.logger.info('Config reloaded')
+
+    def _apply_panel_settings(self):
+        """
+        Hands busy_timeout, spi_chunk_size and spi_speed_hz to the Waveshare driver.
+        The SPI clock is set on the open SPI device right away.
+        """
+        if self.settings.model not in WAVESHARE_MODELS:
+            return
+        self.panel.epd.busy_timeout_ms = self.settings.busy_timeout * 1000
+        self.panel.epd.spi_chunk_size = self.settings.spi_chunk_size
+        self.wave4.epdconfig.set_spi_speed(self.settings.spi_speed_hz)
+
+    def _warm_fonts(self):
+        """
+        Loads the title and artist fonts so the first frame does not pay for it.
+        """
+        try:
+            self.font_cache.warm(self.settings.font_path,
+                                 (self.settings.font_size_title, self.settings.font_size_artist))
+        except OSError as e:
+            self.logger.error(f'Failed to load font {self.settings.font_path}: {e}')
+
+    def _close_panel(self):
+        """
+        Stops the display worker, then puts the Waveshare panel to sleep and releases SPI/GPIO.
+        """
+        if not self.display_worker.stop(timeout=60):
+            self.logger.warning('Display worker still refreshing, leaving the panel as is')
+            return
+        if self.settings.model in WAVESHARE_MODELS:
+            try:
+                self.panel.close()
+            except Exception as e:
+                self.logger.error(f'Panel close error: {e}')
+
     def _load_idle_images(self):
         """Load all valid image files from the idle folder for shuffle/cycle."""
         images = []
@@ -127,145 +386,285 @@ class SpotipiEinkDisplay:
           - Otherwise cycles through the list in order.
         """
         if not self.idle_images:
-            return Image.open(self.default_idle_image)
+            return self._open_image(self.default_idle_image)
 
         if self.idle_shuffle:
-            return Image.open(random.choice(self.idle_images))
+            return self._open_image(random.choice(self.idle_images))
         else:
             img_path = self.idle_images[self.idle_index]
             self.idle_index = (self.idle_index + 1) % len(self.idle_images)
-            return Image.open(img_path)
+            return self._open_image(img_path)
 
-    def _break_fix(self, text: str, width: int, font: ImageFont, draw: ImageDraw):
+    def _open_image(self, source) -> Image:
         """
-        Break a string into lines so that each line does not exceed 'width'.
+        Opens an image file or file object. JPEGs are decoded at the smallest
+        DCT scale (1/2, 1/4 or 1/8) that still leaves REDUCING_GAP times the
+        size the layout needs, so large photos never decode at full resolution.
         """
-        if not text:
-            return
-        if isinstance(text, str):
-            text = text.split()
-        lo = 0
-        hi = len(text)
-        while lo < hi:
-            mid = (lo + hi + 1) // 2
-            t = ' '.join(text[:mid])
-            w = int(draw.textlength(text=t, font=font))
-            if w <= width:
-                lo = mid
-            else:
-                hi = mid - 1
-        t = ' '.join(text[:lo])
-        w = int(draw.textlength(text=t, font=font))
-        yield t, w
-        yield from self._break_fix(text[lo:], width, font, draw)
+        image = Image.open(source)
+        size = self._cover_size(image.size)
+        if size != image.size:
+            image.draft(None, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+        return image
 
     def _fit_text_top_down(
         self, img: Image, text: str, text_color: str, shadow_text_color: str,
         font: ImageFont, y_offset: int, font_size: int,
         x_start_offset: int = 0, x_end_offset: int = 0,
-        offset_text_px_shadow: int = 0
+        offset_text_px_shadow: int = 0, dirty_boxes: list = None
     ) -> int:
         """
         Draw text from top to bottom, wrapping as needed, and return the height used.
+        The box of 'img' the text changed is appended to 'dirty_boxes'.
         """
         width = img.width - x_start_offset - x_end_offset - offset_text_px_shadow
-        draw = ImageDraw.Draw(img)
-        pieces = list(self._break_fix(text, width, font, draw))
-        y = y_offset
-        h_taken_by_text = 0
-        for t, _ in pieces:
-            if offset_text_px_shadow > 0:
-                draw.text((x_start_offset + offset_text_px_shadow, y + offset_text_px_shadow),
-                          t, font=font, fill=shadow_text_color)
-            draw.text((x_start_offset, y), t, font=font, fill=text_color)
-            y += font_size
-            h_taken_by_text += font_size
-        return h_taken_by_text
+        layer = textLayout.text_layer(text, width, font, font_size)
+        box = textLayout.paste_text(img, layer, (x_start_offset, y_offset), text_color,
+                                    shadow_text_color, offset_text_px_shadow)
+        if box is not None and dirty_boxes is not None:
+            dirty_boxes.append(box)
+        return layer.lines * font_size
 
     def _fit_text_bottom_up(
         self, img: Image, text: str, text_color: str, shadow_text_color: str,
         font: ImageFont, y_offset: int, font_size: int,
         x_start_offset: int = 0, x_end_offset: int = 0,
-        offset_text_px_shadow: int = 0
+        offset_text_px_shadow: int = 0, dirty_boxes: list = None
     ) -> int:
         """
         Draw text from bottom upward, wrapping as needed, and return the height used.
+        The box of 'img' the text changed is appended to 'dirty_boxes'.
         """
         width = img.width - x_start_offset - x_end_offset - offset_text_px_shadow
-        draw = ImageDraw.Draw(img)
-        pieces = list(self._break_fix(text, width, font, draw))
-        if len(pieces) > 1:
-            y_offset -= (len(pieces) - 1) * font_size
-        h_taken_by_text = 0
-        for t, _ in pieces:
-            if offset_text_px_shadow > 0:
-                draw.text((x_start_offset + offset_text_px_shadow, y_offset + offset_text_px_shadow),
-                          t, font=font, fill=shadow_text_color)
-            draw.text((x_start_offset, y_offset), t, font=font, fill=text_color)
-            y_offset += font_size
-            h_taken_by_text += font_size
-        return h_taken_by_text
+        layer = textLayout.text_layer(text, width, font, font_size)
+        if layer.lines > 1:
+            y_offset -= (layer.lines - 1) * font_size
+        box = textLayout.paste_text(img, layer, (x_start_offset, y_offset), text_color,
+                                    shadow_text_color, offset_text_px_shadow)
+        if box is not None and dirty_boxes is not None:
+            dirty_boxes.append(box)
+        return layer.lines * font_size
+
+    def _fit_font_sizes(self, settings: RenderSettings, title: str, artist: str) -> tuple:
+        """
+        Returns the (title, artist) font sizes for text_layout = fit: the configured
+        sizes scaled down so both fit text_max_lines lines each, between the small
+        cover and the bottom offset. Results are memoized per text and box.
+        """
+        width = settings.frame_size[0] - settings.offset_px_left - settings.offset_px_right - settings.offset_text_px_shadow
+        top = settings.album_cover_small_px + settings.offset_px_top + 10
+        height = settings.frame_size[1] - settings.offset_px_bottom - top
+        return textLayout.fit_font_sizes(
+            (title, artist), (settings.font_size_title, settings.font_size_artist),
+            width, height, settings.text_max_lines, settings.font_size_min, settings.font_path)
+
+    def _inky_display(self):
+        """
+        Returns the Inky driver, detecting the board only on first use.
+        """
+        if self.inky is None:
+            self.inky = self.inky_auto()
+        return self.inky
+
+    def _log_panel_stats(self, action: str):
+        """
+        Logs how long the panel kept BUSY asserted in each phase of the last refresh
+        and how many GPIO writes and SPI transfers it took.
+        """
+        epd = self.panel.epd
+        phases = ', '.join(f'{phase} {ms:.0f} ms' for phase, ms in epd.busy_times.items())
+        upload = epd.upload_stats
+        throughput = upload['bytes'] / upload['seconds'] / 1024 if upload['seconds'] > 0 else 0
+        self.logger.info(f'Panel {action} busy times: {phases}; '
+                         f"{epd.io_stats['gpio_writes']} GPIO writes, {epd.io_stats['spi_transfers']} SPI transfers; "
+                         f"upload {upload['bytes']} bytes in {upload['seconds'] * 1000:.0f} ms ({throughput:.0f} KiB/s)")
 
     def _display_clean(self):
         """
         Clears the display (two passes) for Inky or Waveshare.
         """
         try:
-            if self.config.get('DEFAULT', 'model') == 'inky':
-                inky = self.inky_auto()
+            if self.settings.model == 'inky':
+                inky = self._inky_display()
                 for _ in range(2):
                     for y in range(inky.height):
                         for x in range(inky.width):
                             inky.set_pixel(x, y, self.inky_clean)
                     inky.show()
                     time.sleep(1.0)
-            elif self.config.get('DEFAULT', 'model') == 'waveshare4':
-                epd = self.wave4.EPD()
-                epd.init()
-                epd.Clear()
+            elif self.settings.model in WAVESHARE_MODELS:
+                # No sleep afterwards, the next frame follows right away and
+                # can skip the wake reset
+                self.panel.clear()
+                self._log_panel_stats('clean')
+            self._remember_frame(None)
         except Exception as e:
+            self._remember_frame(None)
             self.logger.error(f'Display clean error: {e}')
             self.logger.error(traceback.format_exc())
 
-    def _convert_image_wave(self, img: Image, saturation: int = 2) -> Image:
+    def _convert_image_wave(self, img: Image) -> Image:
         """
         Convert an Image to the 7-color format needed by Waveshare 4".
+        The palette indices of the returned 'P' image are the panel colour codes.
         """
-        converter = ImageEnhance.Color(img)
-        img = converter.enhance(saturation)
-        palette_data = [
-            0x00, 0x00, 0x00,   # black
-            0xff, 0xff, 0xff,   # white
-            0x00, 0xff, 0x00,   # green
-            0x00, 0x00, 0xff,   # blue
-            0xff, 0x00, 0x00,   # red
-            0xff, 0xff, 0x00,   # yellow
-            0xff, 0x80, 0x00    # orange
-        ]
-        palette_image = Image.new('P', (1, 1))
-        palette_image.putpalette(palette_data + [0, 0, 0] * 248)
-        img.load()
-        palette_image.load()
-        im = img.im.convert('P', True, palette_image.im)
-        return img._new(im)
-
-    def _display_image(self, image: Image, saturation: float = 0.5):
-        """
-        Shows the Image on the Inky or Waveshare display.
+        settings = self.settings
+        palette = colorQuantizer.WAVESHARE_PALETTE
+        if settings.dither == 'floyd-steinberg':
+            return colorQuantizer.quantize_dithered(img, palette, settings.color_saturation)
+        return self._quantize(img, palette, settings.color_saturation)
+
+    def _convert_frame_wave(self, frame: Frame) -> Image:
+        """
+        Like _convert_image_wave(frame.image). For a frame drawn on a cached album
+        layer with dither = none or ordered the layer's palette indices are cached
+        as well and only the text box is quantized and spliced in. Every pixel maps
+        on its own (the box starts on the 8x8 Bayer grid), so the result equals
+        quantizing the whole frame. Floyd-Steinberg diffuses error across the
+        whole frame and always quantizes all of it.
+        """
+        settings = self.settings
+        if frame.layer is None or settings.dither == 'floyd-steinberg':
+            return self._convert_image_wave(frame.image)
+        key = (frame.layer_key, settings.dither, settings.color_saturation)
+        layer_indices = self.quantized_layers.get(key)
+        if layer_indices is None:
+            layer_indices = np.asarray(self._convert_image_wave(frame.layer))
+            self.quantized_layers.put(key, layer_indices)
+        indices = layer_indices.copy()
+        if frame.dirty_box is not None:
+            left, top, right, bottom = frame.dirty_box
+            if settings.dither == 'ordered':
+                left, top = left - left % 8, top - top % 8
+            box = (left, top, right, bottom)
+            indices[top:bottom, left:right] = np.asarray(self._convert_image_wave(frame.image.crop(box)))
+        image_wave = Image.fromarray(indices, 'P')
+        image_wave.putpalette(colorQuantizer.palette_image(colorQuantizer.WAVESHARE_PALETTE).getpalette())
+        return image_wave
+
+    def _quantize(self, img: Image, palette: tuple, saturation: float) -> Image:
         """
+        Maps 'img' onto 'palette' with the table driven engines, dither = ordered or none.
+        """
+        lut = self._color_lut(palette, saturation)
+        if self.settings.dither == 'ordered':
+            return colorQuantizer.quantize_ordered(img, lut, palette, threads=os.cpu_count() or 1)
+        return colorQuantizer.quantize_lut(img, lut, palette)
+
+    def _color_lut(self, palette: tuple, saturation: float):
+        """
+        Returns the palette lookup table for 'palette' and 'saturation', loading
+        (or building) it on first use.
+        """
+        key = (palette, saturation, self.settings.lut_cache_dir)
+        lut = self._luts.get(key)
+        if lut is None:
+            lut = self._luts[key] = colorQuantizer.load_lut(self.settings.lut_cache_dir, palette, saturation)
+        return lut
+
+    def _display_image(self, frame: Frame, saturation: float = 0.5) -> str:
+        """
+        Shows the Frame on the Inky or Waveshare display.
+        Returns FRAME_SKIPPED if the panel already shows that frame and FRAME_FAILED
+        if the refresh raised, FRAME_SHOWN otherwise.
+        """
+        settings = self.settings
+        image = frame.image
         try:
-            if self.config.get('DEFAULT', 'model') == 'inky':
-                inky = self.inky_auto()
+            if settings.model == 'inky':
+                inky = self._inky_display()
+                if settings.orientation == 'portrait':
+                    # Rotate into panel order, same direction as the Waveshare packer
+                    image = image.transpose(Image.Transpose.ROTATE_90)
+                frame_bytes = image.convert('RGB').tobytes()
+                if self._frame_unchanged(frame_bytes):
+                    return FRAME_SKIPPED
+                if settings.dither != 'floyd-steinberg' and hasattr(inky, '_palette_blend'):
+                    # set_image takes 'P' images as they are, quantize with the
+                    # palette the library would have used for this saturation
+                    blend = inky._palette_blend(saturation)
+                    palette = tuple(tuple(blend[i:i + 3]) for i in range(0, 21, 3))
+                    image = self._quantize(image, palette, 1.0)
                 inky.set_image(image, saturation=saturation)
                 inky.show()
-            elif self.config.get('DEFAULT', 'model') == 'waveshare4':
-                epd = self.wave4.EPD()
-                epd.init()
-                epd.display(epd.getbuffer(self._convert_image_wave(image)))
-                epd.sleep()
+            elif settings.model in WAVESHARE_MODELS:
+                image_wave = self._convert_frame_wave(frame)
+                # The palette indices identify the frame, the skip check
+                # runs before anything is packed
+                frame_bytes = image_wave.tobytes()
+                if self._frame_unchanged(frame_bytes):
+                    return FRAME_SKIPPED
+                self.panel.display(self.panel.epd.getbuffer_indices(frame_bytes, *image_wave.size))
+                self._log_panel_stats('display')
+                self.panel.sleep()
+            self._remember_frame(frame_bytes)
         except Exception as e:
+            # Unknown panel content, the next frame must not be skipped
+            self._remember_frame(None)
             self.logger.error(f'Display image error: {e}')
             self.logger.error(traceback.format_exc())
+            return FRAME_FAILED
+        return FRAME_SHOWN
+
+    def _frame_unchanged(self, frame) -> bool:
+        """
+        True if 'frame' (palette indices for Waveshare, RGB bytes for Inky)
+        matches what the panel shows. With refresh_skip_threshold > 0 frames
+        differing in less than that percentage of their bytes count as unchanged as well.
+        """
+        if self.display_state.get('frame_hash') is None:
+            return False
+        if hashlib.blake2b(frame, digest_size=16).hexdigest() == self.display_state['frame_hash']:
+            self.logger.info('Frame unchanged, skipping panel refresh')
+            return True
+        threshold = self.settings.refresh_skip_threshold
+        if threshold <= 0 or self.last_frame is None or len(self.last_frame) != len(frame):
+            return False
+        changed = np.count_nonzero(np.frombuffer(frame, dtype=np.uint8) != np.frombuffer(self.last_frame, dtype=np.uint8))
+        changed_percent = 100.0 * changed / len(frame)
+        if changed_percent < threshold:
+            self.logger.info(f'Frame differs in {changed_percent:.2f}% only, skipping panel refresh')
+            return True
+        return False
+
+    def _remember_frame(self, frame):
+        """
+        Records the frame now on the panel, None if the content is unknown.
+        """
+        if frame is None:
+            self.display_state['frame_hash'] = None
+            self.last_frame = None
+            return
+        self.display_state['frame_hash'] = hashlib.blake2b(frame, digest_size=16).hexdigest()
+        if self.settings.refresh_skip_threshold > 0:
+            self.last_frame = bytes(frame)
+
+    def _load_display_state(self) -> dict:
+        """
+        Loads what the panel showed before the last restart.
+        """
+        try:
+            with open(self.display_state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.error(f'Failed to load display state: {e}')
+            return {}
+
+    def _save_display_state(self):
+        """
+        Persists the display state, written to a temp file first so a power
+        loss never leaves a truncated file behind.
+        """
+        self.display_state['pic_counter'] = self.pic_counter
+        tmp_file = self.display_state_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.display_state, f)
+            os.replace(tmp_file, self.display_state_file)
+        except Exception as e:
+            self.logger.error(f'Failed to save display state: {e}')
 
     def _gen_pic(self, image: Image, artist: str, title: str, show_small_cover: bool) -> Image:
         """
@@ -273,114 +672,154 @@ class SpotipiEinkDisplay:
         background blur (if configured), and optional text (title/artist).
         'show_small_cover' controls whether we paste a small overlay of 'image'.
         """
-        album_cover_small_px = self.config.getint('DEFAULT', 'album_cover_small_px')
-        offset_px_left = self.config.getint('DEFAULT', 'offset_px_left')
-        offset_px_right = self.config.getint('DEFAULT', 'offset_px_right')
-        offset_px_top = self.config.getint('DEFAULT', 'offset_px_top')
-        offset_px_bottom = self.config.getint('DEFAULT', 'offset_px_bottom')
-        offset_text_px_shadow = self.config.getint('DEFAULT', 'offset_text_px_shadow', fallback=0)
-        text_direction = self.config.get('DEFAULT', 'text_direction', fallback='top-down')
-        background_blur = self.config.getint('DEFAULT', 'background_blur', fallback=0)
+        # One snapshot per frame, a reload in between cannot mix old and new values
+        settings = self.settings
+        return self._draw_text(self._gen_layer(image, show_small_cover, settings), artist, title, settings)
+
+    def _gen_track_pic(self, cover_url: str, artist: str, title: str) -> Frame:
+        """
+        Like _gen_pic for a playing track. The background and small cover layer is
+        cached per cover URL and layout, the next track of the same album only
+        draws its text and the cover is not even loaded. Returns the Frame with
+        the layer and the box the text covers.
+        """
+        settings = self.settings
+        start = time.perf_counter()
+        key = (cover_url,) + settings.layer_key()
+        layer = self.album_layers.get(key)
+        if layer is None:
+            layer = self._gen_layer(self._load_cover(cover_url), True, settings)
+            self.album_layers.put(key, layer)
+        else:
+            self.render_timings = {'cached layer': (time.perf_counter() - start) * 1000.0}
+        boxes = []
+        image = self._draw_text(layer.copy(), artist, title, settings, boxes)
+        dirty_box = None
+        if boxes:
+            dirty_box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                         max(b[2] for b in boxes), max(b[3] for b in boxes))
+        return Frame(image, key, layer, dirty_box)
+
+    def _gen_layer(self, image: Image, show_small_cover: bool, settings: RenderSettings) -> Image:
+        """
+        Background (fit or repeat, blurred if configured) with the small cover pasted on top.
+        """
+        start = time.perf_counter()
 
         bg_w, bg_h = image.size
+        # Compose at the logical size, the display path rotates portrait frames
+        target_size = settings.frame_size
 
         # Fit or repeat background
-        bg_mode = self.config.get('DEFAULT', 'background_mode', fallback='fit')
-        if bg_mode == 'fit':
-            target_size = (self.config.getint('DEFAULT', 'width'),
-                           self.config.getint('DEFAULT', 'height'))
+        if settings.background_mode == 'fit':
             if bg_w != target_size[0] or bg_h != target_size[1]:
-                image_new = ImageOps.fit(image, target_size, centering=(0.0, 0.0))
+                image_new = self._fit_background(image, target_size)
             else:
                 image_new = image.crop((0, 0, target_size[0], target_size[1]))
-        elif bg_mode == 'repeat':
-            target_w = self.config.getint('DEFAULT', 'width')
-            target_h = self.config.getint('DEFAULT', 'height')
-            image_new = Image.new('RGB', (target_w, target_h))
-            for x in range(0, target_w, bg_w):
-                for y in range(0, target_h, bg_h):
-                    image_new.paste(image, (x, y))
         else:
-            # fallback
-            target_size = (self.config.getint('DEFAULT', 'width'),
-                           self.config.getint('DEFAULT', 'height'))
-            image_new = image.crop((0, 0, target_size[0], target_size[1]))
+            # repeat
+            image_new = self._tile_background(image, target_size)
+
+        background_done = time.perf_counter()
 
         # Optional blur: apply only if small artwork is enabled
-        if self.config.getboolean('DEFAULT', 'album_cover_small') and background_blur > 0:
-            image_new = image_new.filter(ImageFilter.GaussianBlur(background_blur))
+        if settings.album_cover_small and settings.background_blur > 0:
+            image_new = self._blur_background(image_new, settings.background_blur)
+        blur_done = time.perf_counter()
 
         # Paste smaller cover if show_small_cover and config says album_cover_small = True
-        if show_small_cover and self.config.getboolean('DEFAULT', 'album_cover_small'):
-            cover_smaller = image.resize((album_cover_small_px, album_cover_small_px), Image.LANCZOS)
-            album_pos_x = (image_new.width - album_cover_small_px) // 2
-            image_new.paste(cover_smaller, (album_pos_x, offset_px_top))
+        if show_small_cover and settings.album_cover_small:
+            cover_smaller = image.resize((settings.album_cover_small_px, settings.album_cover_small_px), Image.LANCZOS,
+                                         reducing_gap=REDUCING_GAP)
+            album_pos_x = (image_new.width - settings.album_cover_small_px) // 2
+            image_new.paste(cover_smaller, (album_pos_x, settings.offset_px_top))
+        cover_done = time.perf_counter()
 
-        # Prepare fonts
-        font_title = ImageFont.truetype(self.config.get('DEFAULT', 'font_path'),
-                                        self.config.getint('DEFAULT', 'font_size_title'))
-        font_artist = ImageFont.truetype(self.config.get('DEFAULT', 'font_path'),
-                                         self.config.getint('DEFAULT', 'font_size_artist'))
+        self.render_timings = {
+            'background': (background_done - start) * 1000.0,
+            'blur': (blur_done - background_done) * 1000.0,
+            'cover': (cover_done - blur_done) * 1000.0,
+        }
+        return image_new
 
-        draw = ImageDraw.Draw(image_new)
+    def _draw_text(self, image_new: Image, artist: str, title: str, settings: RenderSettings,
+                   dirty_boxes: list = None) -> Image:
+        """
+        Draws title and artist into 'image_new' according to text_direction and text_layout.
+        The boxes the text changed are appended to 'dirty_boxes'.
+        """
+        start = time.perf_counter()
+
+        # Prepare fonts, 'fit' shrinks them until title and artist fit below the cover
+        font_size_title, font_size_artist = settings.font_size_title, settings.font_size_artist
+        if settings.text_layout == 'fit':
+            font_size_title, font_size_artist = self._fit_font_sizes(settings, title, artist)
+        font_title = self.font_cache.get(settings.font_path, font_size_title)
+        font_artist = self.font_cache.get(settings.font_path, font_size_artist)
 
         # Render text
-        if text_direction == 'top-down':
+        if settings.text_direction == 'top-down':
             # Use the fixed offsets as in the older version
-            title_position_y = album_cover_small_px + offset_px_top + 10
+            title_position_y = settings.album_cover_small_px + settings.offset_px_top + 10
             title_height = self._fit_text_top_down(
                 img=image_new,
                 text=title,
                 text_color='white',
                 shadow_text_color='black',
                 font=font_title,
-                font_size=self.config.getint('DEFAULT', 'font_size_title'),
+                font_size=font_size_title,
                 y_offset=title_position_y,
-                x_start_offset=offset_px_left,
-                x_end_offset=offset_px_right,
-                offset_text_px_shadow=offset_text_px_shadow
+                x_start_offset=settings.offset_px_left,
+                x_end_offset=settings.offset_px_right,
+                offset_text_px_shadow=settings.offset_text_px_shadow,
+                dirty_boxes=dirty_boxes
             )
-            artist_position_y = album_cover_small_px + offset_px_top + 10 + title_height
+            artist_position_y = settings.album_cover_small_px + settings.offset_px_top + 10 + title_height
             self._fit_text_top_down(
                 img=image_new,
                 text=artist,
                 text_color='white',
                 shadow_text_color='black',
                 font=font_artist,
-                font_size=self.config.getint('DEFAULT', 'font_size_artist'),
+                font_size=font_size_artist,
                 y_offset=artist_position_y,
-                x_start_offset=offset_px_left,
-                x_end_offset=offset_px_right,
-                offset_text_px_shadow=offset_text_px_shadow
+                x_start_offset=settings.offset_px_left,
+                x_end_offset=settings.offset_px_right,
+                offset_text_px_shadow=settings.offset_text_px_shadow,
+                dirty_boxes=dirty_boxes
             )
-        elif text_direction == 'bottom-up':
-            artist_position_y = image_new.height - (offset_px_bottom + self.config.getint('DEFAULT', 'font_size_artist'))
+        else:
+            # bottom-up
+            artist_position_y = image_new.height - (settings.offset_px_bottom + font_size_artist)
             artist_height = self._fit_text_bottom_up(
                 img=image_new,
                 text=artist,
                 text_color='white',
                 shadow_text_color='black',
                 font=font_artist,
-                font_size=self.config.getint('DEFAULT', 'font_size_artist'),
+                font_size=font_size_artist,
                 y_offset=artist_position_y,
-                x_start_offset=offset_px_left,
-                x_end_offset=offset_px_right,
-                offset_text_px_shadow=offset_text_px_shadow
+                x_start_offset=settings.offset_px_left,
+                x_end_offset=settings.offset_px_right,
+                offset_text_px_shadow=settings.offset_text_px_shadow,
+                dirty_boxes=dirty_boxes
             )
-            title_position_y = image_new.height - (offset_px_bottom + self.config.getint('DEFAULT', 'font_size_title')) - artist_height
+            title_position_y = image_new.height - (settings.offset_px_bottom + font_size_title) - artist_height
             self._fit_text_bottom_up(
                 img=image_new,
                 text=title,
                 text_color='white',
                 shadow_text_color='black',
                 font=font_title,
-                font_size=self.config.getint('DEFAULT', 'font_size_title'),
+                font_size=font_size_title,
                 y_offset=title_position_y,
-                x_start_offset=offset_px_left,
-                x_end_offset=offset_px_right,
-                offset_text_px_shadow=offset_text_px_shadow
+                x_start_offset=settings.offset_px_left,
+                x_end_offset=settings.offset_px_right,
+                offset_text_px_shadow=settings.offset_text_px_shadow,
+                dirty_boxes=dirty_boxes
             )
 
+        self.render_timings['text'] = (time.perf_counter() - start) * 1000.0
         return image_new
 
     def _display_update_process(self, song_request: list):
@@ -390,47 +829,180 @@ class SpotipiEinkDisplay:
         if song_request:
             # song_request: [song_title, album_url, artist]
             try:
-                resp = requests.get(song_request[1], stream=True)
-                resp.raise_for_status()
-                cover = Image.open(resp.raw)
-
-                # show_small_cover=True for active track
-                image = self._gen_pic(
-                    cover,
+                # Small cover shown for the active track
+                frame = self._gen_track_pic(
+                    song_request[1],
                     artist=song_request[2],
-                    title=song_request[0],
-                    show_small_cover=True
+                    title=song_request[0]
                 )
             except Exception as e:
                 self.logger.error(f"Failed to fetch/open album cover: {e}")
                 self.logger.error(traceback.format_exc())
 
-                fallback_cover = Image.open(self.default_idle_image)
-                image = self._gen_pic(
+                fallback_cover = self._open_image(self.default_idle_image)
+                frame = Frame(self._gen_pic(
                     fallback_cover,
                     artist=song_request[2],
                     title=song_request[0],
                     show_small_cover=True
-                )
+                ), None, None, None)
         else:
             # Idle: no text, no small cover
             idle_img = self._get_idle_image()
-            image = self._gen_pic(
+            frame = Frame(self._gen_pic(
                 idle_img,
                 artist="",
                 title="",
                 show_small_cover=False
-            )
+            ), None, None, None)
+
+        self.logger.debug('Render times: ' + ', '.join(f'{part} {ms:.1f} ms' for part, ms in self.render_timings.items()))
+        stats = self.font_cache.stats()
+        layers = textLayout.text_layer.cache_info()
+        fitted = textLayout.fit_font_sizes.cache_info()
+        self.logger.debug(f"Font cache: {stats['hits']} hits, {stats['misses']} misses, {stats['fonts']} fonts loaded; "
+                          f"text layers: {layers.hits} hits, {layers.misses} misses; "
+                          f"fitted layouts: {fitted.hits} hits, {fitted.misses} misses")
+        self.logger.debug('Layer caches: ' + ', '.join(
+            f"{name} {stats['hits']}/{stats['hits'] + stats['misses']} hits ({stats['hit_rate']:.0%})"
+            for name, stats in self.layer_cache_stats().items()))
+
+        # Hand the frame to the display worker, polling continues meanwhile
+        self.display_worker.submit(frame)
+
+    def layer_cache_stats(self) -> dict:
+        """
+        Hit and miss counters of the album, blur, tile and quantized layer caches.
+        """
+        return {
+            'album': self.album_layers.stats(),
+            'blur': self.blur_layers.stats(),
+            'tile': self.tile_layers.stats(),
+            'quantized': self.quantized_layers.stats(),
+        }
+
+    def _fit_background(self, image: Image, size: tuple) -> Image:
+        """
+        Crops 'image' from the top left to the aspect ratio of 'size' and scales it
+        to 'size', the same as ImageOps.fit(image, size, centering=(0.0, 0.0))
+        but shrinking large images with a reducing gap.
+        """
+        width, height = image.size
+        ratio = width / height
+        output_ratio = size[0] / size[1]
+        if ratio == output_ratio:
+            box = (0, 0, width, height)
+        elif ratio > output_ratio:
+            box = (0, 0, output_ratio * height, height)
+        else:
+            box = (0, 0, width, width / output_ratio)
+        return image.resize(size, Image.BICUBIC, box=box, reducing_gap=REDUCING_GAP)
+
+    def _tile_background(self, image: Image, size: tuple) -> Image:
+        """
+        Repeats 'image' from the top left over a frame of 'size'. The tiled area
+        doubles with every paste, so any tile size takes a handful of pastes.
+        The result is cached per tile content and frame size.
+        """
+        key = (hashlib.blake2b(image.tobytes(), digest_size=16).digest(), image.size, image.mode, size)
+        tiled = self.tile_layers.get(key)
+        if tiled is None:
+            target_w, target_h = size
+            tile_w, tile_h = image.size
+            tiled = Image.new('RGB', size)
+            tiled.paste(image, (0, 0))
+            filled = tile_w
+            while filled < target_w:
+                tiled.paste(tiled.crop((0, 0, filled, tile_h)), (filled, 0))
+                filled *= 2
+            filled = tile_h
+            while filled < target_h:
+                tiled.paste(tiled.crop((0, 0, target_w, filled)), (0, filled))
+                filled *= 2
+            self.tile_layers.put(key, tiled)
+        return tiled.copy()
+
+    def _blur_background(self, image: Image, radius: int) -> Image:
+        """
+        Gaussian blur of 'image' computed on a copy shrunk by radius // BLUR_STEP
+        and scaled back up. The result is cached per background content and radius.
+        """
+        key = (hashlib.blake2b(image.tobytes(), digest_size=16).digest(), image.size, image.mode, radius)
+        blurred = self.blur_layers.get(key)
+        if blurred is None:
+            factor = max(1, radius // BLUR_STEP)
+            if factor > 1:
+                width, height = image.size
+                blurred = image.reduce(factor).filter(ImageFilter.GaussianBlur(radius / factor))
+                blurred = blurred.resize(image.size, Image.BICUBIC, box=(0, 0, width / factor, height / factor))
+            else:
+                blurred = image.filter(ImageFilter.GaussianBlur(radius))
+            self.blur_layers.put(key, blurred)
+        # The frame gets the cover and text pasted into it, keep the cached one clean
+        return blurred.copy()
+
+    def _cover_size(self, size: tuple) -> tuple:
+        """
+        Smallest size a cover of 'size' can be scaled to that still fills the
+        frame in 'fit' mode and the small cover without upscaling.
+        """
+        settings = self.settings
+        if settings.background_mode != 'fit':
+            # Tiles are pasted at their own size
+            return size
+        width, height = size
+        frame_w, frame_h = settings.frame_size
+        small_px = settings.album_cover_small_px if settings.album_cover_small else 0
+        scale = max(frame_w / width, frame_h / height, small_px / width, small_px / height)
+        if scale >= 1:
+            return size
+        return math.ceil(width * scale), math.ceil(height * scale)
 
+    def _load_cover(self, url: str) -> Image:
+        """
+        Returns the album cover at 'url', from the cover cache if it was fetched
+        before. Fetched covers are cached scaled down to what the layout needs.
+        """
+        if self.cover_cache is None:
+            resp = requests.get(url)
+            resp.raise_for_status()
+            return self._open_image(io.BytesIO(resp.content))
+        settings = self.settings
+        variant = (f'{settings.frame_size[0]}x{settings.frame_size[1]},{settings.background_mode},'
+                   f'{settings.album_cover_small_px if settings.album_cover_small else 0}')
+        key = self.cover_cache.key(url, variant)
+        cover = self.cover_cache.get(key)
+        if cover is None:
+            resp = requests.get(url)
+            resp.raise_for_status()
+            cover = self._open_image(io.BytesIO(resp.content))
+            size = self._cover_size(cover.size)
+            if size != cover.size:
+                cover = cover.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+                self.cover_cache.put(key, coverCache.encode_jpeg(cover))
+            else:
+                self.cover_cache.put(key, resp.content)
+        stats = self.cover_cache.stats()
+        self.logger.debug(f"Cover cache: {stats['hits']} hits, {stats['misses']} misses, "
+                          f"{stats['files']} covers, {stats['bytes'] // 1024} KiB")
+        return cover
+
+    def _display_frame(self, frame: Frame) -> str:
+        """
+        Runs on the display worker thread: cleans occasionally and shows the frame.
+        Returns the outcome of _display_image.
+        """
         # Clean screen occasionally
-        refresh_limit = self.config.getint('DEFAULT', 'display_refresh_counter', fallback=20)
-        if self.pic_counter > refresh_limit:
+        if self.pic_counter > self.settings.display_refresh_counter:
             self._display_clean()
             self.pic_counter = 0
 
         # Show final image
-        self._display_image(image)
-        self.pic_counter += 1
+        result = self._display_image(frame)
+        if result == FRAME_SHOWN:
+            self.pic_counter += 1
+        self._save_display_state()
+        return result
 
     @limit_recursion(limit=10)
     def _get_song_info(self) -> list:
@@ -483,11 +1055,15 @@ class SpotipiEinkDisplay:
         Main loop: polls Spotify for current track, or idle if none.
         """
         self.logger.info('Service started')
-        self._display_clean()
+        if self.config.getboolean('DEFAULT', 'clean_on_start', fallback=True):
+            self._display_clean()
+            self.pic_counter = 0
+        self.display_worker.start()
 
         try:
             while True:
                 try:
+                    self._apply_pending_reload()
                     song_request = self._get_song_info()
                     self.logger.debug(f"Song info returned: {song_request}")
                     if song_request:
@@ -508,6 +1084,7 @@ class SpotipiEinkDisplay:
                         while elapsed < self.idle_display_time:
                             time.sleep(sleep_increment)
                             elapsed += sleep_increment
+                            self._apply_pending_reload()
                             if self._get_song_info():
                                 self.logger.info("Track detected during idle sleep; breaking idle sleep early.")
                                 break
@@ -520,6 +1097,7 @@ class SpotipiEinkDisplay:
 
         except KeyboardInterrupt:
             self.logger.info("Service stopping via KeyboardInterrupt")
+            self._close_panel()
             sys.exit(0)
 
 
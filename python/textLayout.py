@@ -0,0 +1,200 @@
+import weakref
+import functools
+import collections
+from PIL import Image, ImageDraw, ImageFont
+import fontCache
+
+# Words remembered per font, the least recently used ones are dropped beyond this
+MAX_WORDS_PER_FONT = 4096
+
+
+class WordWidths:
+    """
+    Advance widths of single words for one font. For each word it keeps
+    len(word), len(word + ' ') and len(' ' + word). Any line made of those
+    words can then be measured exactly, kerning around the spaces included:
+
+        len(a + ' ' + b) = len(a + ' ') + len(' ' + b) - len(' ')
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+        self.space = font.getlength(' ')
+        self._words = collections.OrderedDict()
+        self.lookups = 0
+        self.measured = 0
+
+    def get(self, word: str) -> tuple:
+        """
+        Returns (width, width with a trailing space, width with a leading space).
+        """
+        self.lookups += 1
+        widths = self._words.get(word)
+        if widths is not None:
+            self._words.move_to_end(word)
+            return widths
+        self.measured += 1
+        widths = (self.font.getlength(word), self.font.getlength(word + ' '), self.font.getlength(' ' + word))
+        self._words[word] = widths
+        if len(self._words) > MAX_WORDS_PER_FONT:
+            self._words.popitem(last=False)
+        return widths
+
+
+# One WordWidths per font object, released together with the font
+_word_widths = weakref.WeakKeyDictionary()
+
+
+def word_widths(font: ImageFont.FreeTypeFont) -> WordWidths:
+    widths = _word_widths.get(font)
+    if widths is None:
+        widths = _word_widths[font] = WordWidths(font)
+    return widths
+
+
+def break_lines(text, width: int, font: ImageFont.FreeTypeFont):
+    """
+    Breaks 'text' (a string or a list of words) into lines no wider than
+    'width' and yields (line, line width) pairs, same as the recursive
+    binary search in break_lines_legacy, but with one pass over the words
+    using cached word widths. A single word wider than 'width' gets a line
+    of its own instead of never fitting.
+    """
+    if not text:
+        return
+    if isinstance(text, str):
+        text = text.split()
+    widths = word_widths(font)
+    line = []
+    line_w = 0.0
+    prev = None
+    for word in text:
+        w = widths.get(word)
+        if not line:
+            line, line_w, prev = [word], w[0], w
+            continue
+        # Swap the previous word's plain width for its width followed by a space
+        candidate_w = line_w - prev[0] + prev[1] - widths.space + w[2]
+        if int(candidate_w) <= width:
+            line.append(word)
+            line_w, prev = candidate_w, w
+        else:
+            yield ' '.join(line), int(line_w)
+            line, line_w, prev = [word], w[0], w
+    if line:
+        yield ' '.join(line), int(line_w)
+
+
+# A wrapped text block rasterized once: 'mask' is an 'L' coverage image whose
+# (0, 0) lies at 'offset' from the block's first line origin, None for empty text
+TextLayer = collections.namedtuple('TextLayer', 'mask offset lines')
+
+
+@functools.lru_cache(maxsize=32)
+def text_layer(text: str, width: int, font: ImageFont.FreeTypeFont, line_height: int) -> TextLayer:
+    """
+    Wraps 'text' to 'width' and draws the lines, 'line_height' apart, into one
+    coverage mask. Cached, the same title or artist is only rasterized once.
+    """
+    lines = [t for t, _ in break_lines(text, width, font)]
+    if not lines:
+        return TextLayer(None, (0, 0), 0)
+    # Glyphs may reach left of or above the line origin, leave room for them
+    boxes = [font.getbbox(t) for t in lines]
+    left = min(0, min(box[0] for box in boxes))
+    top = min(0, min(box[1] for box in boxes))
+    right = max(box[2] for box in boxes)
+    bottom = max(i * line_height + box[3] for i, box in enumerate(boxes))
+    mask = Image.new('L', (right - left, bottom - top))
+    draw = ImageDraw.Draw(mask)
+    for i, t in enumerate(lines):
+        draw.text((-left, i * line_height - top), t, font=font, fill=255)
+    return TextLayer(mask, (left, top), len(lines))
+
+
+def paste_text(img: Image, layer: TextLayer, xy: tuple, color, shadow_color=None, shadow_offset: int = 0):
+    """
+    Pastes a text layer with its first line origin at 'xy'. The shadow is the
+    same mask pasted 'shadow_offset' pixels right and down in 'shadow_color'.
+    Returns the (left, top, right, bottom) box of 'img' that changed, None if nothing did.
+    """
+    if layer.mask is None:
+        return None
+    x = xy[0] + layer.offset[0]
+    y = xy[1] + layer.offset[1]
+    shadow = max(shadow_offset, 0)
+    if shadow > 0:
+        img.paste(shadow_color, (x + shadow, y + shadow), layer.mask)
+    img.paste(color, (x, y), layer.mask)
+    box = (max(x, 0), max(y, 0),
+           min(x + layer.mask.width + shadow, img.width), min(y + layer.mask.height + shadow, img.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+
+@functools.lru_cache(maxsize=256)
+def fit_font_sizes(texts: tuple, sizes: tuple, width: int, height: int, max_lines: int, min_size: int,
+                   font_path: str) -> tuple:
+    """
+    Scales 'sizes' (one font size per entry of 'texts') down together until every
+    text wraps to at most 'max_lines' lines no wider than 'width' and the stacked blocks,
+    lines * size each, fit into 'height'. The largest fitting scale is binary
+    searched with cached word widths, nothing is rasterized. No size goes below
+    'min_size' (or its configured size if that is smaller), if nothing fits the
+    sizes for 'min_size' are returned.
+    """
+    def scaled(lead: int) -> tuple:
+        # No entry below 'min_size', nor above its configured size
+        return tuple(min(size, max(min_size, round(size * lead / sizes[0]))) for size in sizes)
+
+    def fits(lead: int) -> bool:
+        total = 0
+        for text, size in zip(texts, scaled(lead)):
+            font = fontCache.shared_cache.get(font_path, size)
+            lines = 0
+            for _, line_w in break_lines(text, width, font):
+                # A word wider than the box sits on a line of its own and overflows
+                if line_w > width:
+                    return False
+                lines += 1
+            if lines > max_lines:
+                return False
+            total += lines * size
+        return total <= height
+
+    lo, hi = min(min_size, sizes[0]), sizes[0]
+    if fits(hi):
+        return sizes
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return scaled(lo)
+
+
+def break_lines_legacy(text, width: int, font: ImageFont.FreeTypeFont, draw: ImageDraw):
+    """
+    The original line breaker, kept for the benchmark: binary searches the
+    longest fitting word prefix, measuring every probe, once per output line.
+    """
+    if not text:
+        return
+    if isinstance(text, str):
+        text = text.split()
+    lo = 0
+    hi = len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        t = ' '.join(text[:mid])
+        w = int(draw.textlength(text=t, font=font))
+        if w <= width:
+            lo = mid
+        else:
+            hi = mid - 1
+    t = ' '.join(text[:lo])
+    w = int(draw.textlength(text=t, font=font))
+    yield t, w
+    yield from break_lines_legacy(text[lo:], width, font, draw)